@@ -0,0 +1,93 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+'''
+Benchmark of reading many frames of the same shape with and without
+`out=`.
+
+Each mode runs in its own process so the peak RSS and page fault
+counts are not mixed up.  Run from the `python` directory::
+
+    python benchmarks/bench_loads_out.py [n_frames] [n_particles]
+'''
+import os
+import sys
+import time
+import resource
+import tempfile
+import shutil
+import subprocess
+import numpy as np
+from contextlib import closing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sm_core import data_serialization as ds
+
+
+def make_file(fname, n_frames, n_particles):
+    with closing(ds.SM_serial.open(fname, 'w')) as sms:
+        for k in range(n_frames):
+            sms.dumps(k, 'x', np.random.rand(n_particles))
+
+
+def run(fname, mode):
+    with closing(ds.SM_serial.open(fname, 'r')) as sms:
+        frames = sms.list_frames()
+        buf = np.empty_like(sms.loads(frames[0], 'x'))
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.time()
+        total = 0.
+        for k in frames:
+            if mode == 'out':
+                data = sms.loads(k, 'x', out=buf)
+            else:
+                data = sms.loads(k, 'x')
+            total += data[0]
+        elapsed = time.time() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    print '{0:6s} {1:8.2f} ms/frame {2:10d} minor faults {3:8.1f} MB peak RSS'.format(
+        mode, 1e3 * elapsed / len(frames), after.ru_minflt - before.ru_minflt,
+        after.ru_maxrss / 1024.)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] in ('out', 'alloc'):
+        run(sys.argv[2], sys.argv[1])
+        sys.exit(0)
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_particles = int(sys.argv[2]) if len(sys.argv) > 2 else 10 ** 6
+    base = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(base, 'bench.h5')
+        make_file(fname, n_frames, n_particles)
+        print '{0} frames of {1} float64'.format(n_frames, n_particles)
+        for mode in ('alloc', 'out'):
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), mode, fname])
+    finally:
+        shutil.rmtree(base)
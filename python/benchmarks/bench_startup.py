@@ -0,0 +1,99 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+'''
+Benchmark of the start up of short lived tools, which open a file,
+read a few attributes and the number of frames, and exit.
+
+Each run is a fresh interpreter, the wall time includes starting
+python.  Run from the `python` directory::
+
+    python benchmarks/bench_startup.py [n_frames] [n_runs]
+'''
+import os
+import sys
+import time
+import tempfile
+import shutil
+import subprocess
+from contextlib import closing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+_CODE = {
+    'python': "pass",
+    'import': "from sm_core import data_serialization",
+    'open': ("from sm_core import data_serialization as ds\n"
+             "sms = ds.SM_serial.open({fname!r}, 'r', backend={backend!r})\n"
+             "info = (sms._file.attrs['version'], len(sms.list_frames()), sms._file.attrs['writer'])\n"
+             "sms.close()"),
+    'peek': ("from sm_core import data_serialization as ds\n"
+             "info = ds.peek({fname!r}, attrs=['writer'], backend={backend!r})"),
+}
+
+
+def make_file(fname, n_frames):
+    import numpy as np
+    from sm_core import data_serialization as ds
+    with closing(ds.SM_serial.open(fname, 'w')) as sms:
+        for k in range(n_frames):
+            sms.dumps(k, 'x', np.arange(10.))
+
+
+def time_mode(mode, fname, backend, n_runs):
+    code = _CODE[mode].format(fname=fname, backend=backend)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([p for p in (sys.path[0], env.get('PYTHONPATH')) if p])
+    times = []
+    for _ in range(n_runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        times.append(time.time() - start)
+    return sorted(times)[len(times) // 2]
+
+
+if __name__ == '__main__':
+    from sm_core import backends
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 11
+    base = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(base, 'bench.h5')
+        make_file(fname, n_frames)
+        npy_fname = os.path.join(base, 'bench_npy')
+        backends.convert(fname, npy_fname, 'hdf5', 'npy')
+        print '{0} frames, median of {1} runs'.format(n_frames, n_runs)
+        for mode, backend in (('python', None), ('import', None),
+                              ('open', 'hdf5'), ('peek', 'hdf5'),
+                              ('open', 'npy'), ('peek', 'npy')):
+            label = mode if backend is None else '{0} ({1})'.format(mode, backend)
+            print '{0:14s} {1:8.1f} ms'.format(label, 1e3 * time_mode(mode, fname if backend != 'npy' else npy_fname,
+                                                                      backend, n_runs))
+    finally:
+        shutil.rmtree(base)
@@ -0,0 +1,68 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import sys
+import types
+import importlib
+
+'''
+Deferred imports, so importing the core modules does not pull in
+`numpy` and `h5py` until they are used.  Short lived tools that only
+look at a few attributes (see
+:py:func:`~sm_core.data_serialization.peek`) start several times faster.
+'''
+
+
+class LazyModule(types.ModuleType):
+    '''
+    Stands in for a module, which is imported when one of its
+    attributes is first looked up.  After that its attributes are
+    copied over so they are found without going through this class.
+    '''
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+            self.__dict__['_lazy_module'] = module
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    '''Returns the module `name` if it has been imported already, a
+    :py:class:`LazyModule` for it otherwise
+    '''
+    try:
+        return sys.modules[name]
+    except KeyError:
+        return LazyModule(name)
@@ -0,0 +1,611 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import os
+import os.path
+import json
+import base64
+import shutil
+import collections
+from sm_core import _lazy
+
+h5py = _lazy.lazy_import('h5py')
+np = _lazy.lazy_import('numpy')
+
+'''
+Storage backends for :py:class:`~sm_core.data_serialization.SM_serial`.
+
+A backend opens a file and hands back its root group.  The groups and
+data sets it returns provide the subset of the `h5py` interface that
+`SM_serial` uses:
+
+ - groups: `g[path]`, `path in g`, `g.keys()`, `del g[name]`,
+   `g.require_group(path)`, `g.create_dataset(name, ...)`,
+   `g.move(source, dest)`, `g.attrs`
+ - data sets: `d[sel]`, `d[sel] = value`, `d.shape`, `d.dtype`,
+   `d.maxshape`, `d.resize(shape)`, `d.attrs`
+ - the root group in addition: `filename`, `flush()`, `close()`
+
+so `h5py` objects are used as they are by :py:class:`HDF5Backend`.
+'''
+
+
+class Backend(object):
+    '''
+    Interface of the storage backends.
+    '''
+    name = None   #: name used to select the backend
+
+    def exists(self, fname):
+        '''Returns if there is a file at `fname`
+        '''
+        raise NotImplementedError()
+
+    def open(self, fname, fmode, write_through=False):
+        '''Opens a file and returns its root group, see
+        :py:func:`~sm_core.data_serialization.SM_serial.open` for the
+        arguments.
+        '''
+        raise NotImplementedError()
+
+    def peek(self, fname, attrs=None):
+        '''Reads the attributes of the root group and the names in it,
+        without setting up the file for use
+
+        Parameters
+        ----------
+        fname : :py:class:`str`
+            the file
+        attrs : :py:class:`list` of :py:class:`str` or :py:class:`None`
+            the attributes to read, all if `None`
+
+        Returns
+        -------
+        md : :py:class:`dict`
+            the attributes which exist
+        names : :py:class:`list`
+            the names in the root group
+        '''
+        raise NotImplementedError()
+
+    def is_group(self, obj):
+        '''Returns if `obj` is a group of this backend
+        '''
+        raise NotImplementedError()
+
+    def is_dataset(self, obj):
+        '''Returns if `obj` is a data set of this backend
+        '''
+        raise NotImplementedError()
+
+    def read_into(self, dset, out, source_sel=None):
+        '''Reads (the selection `source_sel` of) `dset` into the
+        existing array `out`, which must have the right shape and be C
+        contiguous
+        '''
+        raise NotImplementedError()
+
+    def to_bytes(self, root):
+        '''Returns the contents of the file as bytes
+        '''
+        raise NotImplementedError("{0} backend can not make a byte snapshot".format(self.name))
+
+
+class HDF5Backend(Backend):
+    '''
+    Backend storing everything in one hdf5 file with `h5py`.
+
+    Parameters
+    ----------
+    memory : bool
+        if the file should be kept in memory with the core driver
+    '''
+    def __init__(self, memory=False):
+        self._memory = memory
+        self.name = 'memory' if memory else 'hdf5'
+
+    def exists(self, fname):
+        return os.path.isfile(fname)
+
+    def open(self, fname, fmode, write_through=False):
+        if self._memory:
+            return h5py.File(fname, fmode, driver='core', backing_store=write_through)
+        if write_through:
+            raise ValueError("write_through only applies to the memory backend")
+        return h5py.File(fname, fmode)
+
+    def peek(self, fname, attrs=None):
+        with h5py.File(fname, 'r') as root:
+            keys = root.attrs.keys() if attrs is None else attrs
+            md = dict((k, root.attrs[k]) for k in keys if k in root.attrs)
+            # the low level listing is several times faster than keys()
+            names = list(h5py.h5g.open(root.id, '/'))
+        return md, names
+
+    def open_image(self, image, fmode):
+        '''Opens an in-memory file from the bytes returned by
+        :py:func:`to_bytes`, `fmode` is 'r' or 'r+'
+        '''
+        flags = h5py.h5f.FILE_IMAGE_OPEN_RW if fmode == 'r+' else 0
+        return h5py.File(h5py.h5f.open_file_image(image, flags=flags))
+
+    def is_group(self, obj):
+        return isinstance(obj, h5py._hl.group.Group)
+
+    def is_dataset(self, obj):
+        return isinstance(obj, h5py._hl.dataset.Dataset)
+
+    def read_into(self, dset, out, source_sel=None):
+        if out.size:
+            dset.read_direct(out, source_sel)
+
+    def to_bytes(self, root):
+        root.flush()
+        return root.id.get_file_image()
+
+
+class NpyDirBackend(Backend):
+    '''
+    Backend storing the file as a directory tree with the same layout,
+    each data set is a raw `.npy` file and the attributes of each
+    object are kept in JSON side car files.
+
+    Data sets are read as read-only memory maps (`np.load(mmap_mode='r')`),
+    so reads do not copy and many processes can read at once without
+    any locking.  Storage options meant for hdf5 (chunks, compression,
+    ...) are ignored.
+    '''
+    name = 'npy'
+
+    def exists(self, fname):
+        return os.path.isdir(fname)
+
+    def open(self, fname, fmode, write_through=False):
+        if write_through:
+            raise ValueError("write_through only applies to the memory backend")
+        exists = os.path.isdir(fname)
+        if fmode in ('r', 'r+') and not exists:
+            raise IOError("no such directory: {0}".format(fname))
+        if fmode == 'w-' and exists:
+            raise IOError("directory already exists: {0}".format(fname))
+        if fmode == 'w' and exists and os.listdir(fname):
+            # only ever truncate what we wrote
+            md = NpyRoot(fname, False)._read_md()['attrs']
+            if 'version' not in md and 'writer' not in md:
+                raise IOError("not truncating {0}, it is not an SM_serial directory".format(fname))
+            shutil.rmtree(fname)
+        if not os.path.isdir(fname):
+            os.makedirs(fname)
+        return NpyRoot(fname, fmode != 'r')
+
+    def peek(self, fname, attrs=None):
+        if not os.path.isdir(fname):
+            raise IOError("no such directory: {0}".format(fname))
+        root = NpyRoot(fname, False)
+        all_md = dict(root.attrs)
+        keys = all_md.keys() if attrs is None else attrs
+        md = dict((k, all_md[k]) for k in keys if k in all_md)
+        # keys() without telling groups from files, which needs a stat each
+        names = [name[:-4] if name.endswith('.npy') else name for name in os.listdir(fname)
+                 if not name.startswith('.') and not name.endswith('.json')]
+        return md, names
+
+    def is_group(self, obj):
+        return isinstance(obj, NpyGroup)
+
+    def is_dataset(self, obj):
+        return isinstance(obj, NpyDataset)
+
+    def read_into(self, dset, out, source_sel=None):
+        out[...] = dset[source_sel if source_sel is not None else Ellipsis]
+
+
+_BACKENDS = {'hdf5': HDF5Backend(),
+             'memory': HDF5Backend(memory=True),
+             'npy': NpyDirBackend()}
+
+
+def get_backend(name):
+    '''Returns the backend registered as `name`
+
+    Parameters
+    ----------
+    name : :py:class:`str`
+        in the set {'hdf5', 'memory', 'npy'}
+    '''
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise ValueError("invalid backend {0}".format(name))
+
+
+def convert(src_fname, dst_fname, src_backend='hdf5', dst_backend='npy', **kwargs):
+    '''Copies a file from one backend to another, for example to turn an
+    hdf5 file into an `.npy` directory tree or back.
+
+    Parameters
+    ----------
+    src_fname : :py:class:`str`
+        path of the file to copy
+    dst_fname : :py:class:`str`
+        path of the copy, must not exist
+    src_backend, dst_backend : :py:class:`str`
+        names of the backends, see :py:func:`get_backend`
+
+    additional kwargs are passed to `create_dataset` of the destination
+    (for example compression settings for hdf5)
+    '''
+    src = get_backend(src_backend)
+    dst = get_backend(dst_backend)
+    src_root = src.open(src_fname, 'r')
+    try:
+        dst_root = dst.open(dst_fname, 'w-')
+        try:
+            _copy_group(src, src_root, dst_root, kwargs)
+        finally:
+            dst_root.close()
+    finally:
+        src_root.close()
+
+
+def _copy_group(src, src_grp, dst_grp, kwargs):
+    """Private function to recursively copy `src_grp` into `dst_grp`
+    """
+    for key, value in src_grp.attrs.items():
+        dst_grp.attrs[key] = value
+    for key in src_grp.keys():
+        obj = src_grp[key]
+        if src.is_group(obj):
+            _copy_group(src, obj, dst_grp.require_group(key), kwargs)
+        elif src.is_dataset(obj):
+            dset_kwargs = dict(kwargs)
+            if obj.maxshape != obj.shape:
+                # keep resizable data sets (the summary tables) resizable
+                dset_kwargs['maxshape'] = obj.maxshape
+            dset = dst_grp.create_dataset(key, data=obj[...], **dset_kwargs)
+            for attr_key, value in obj.attrs.items():
+                dset.attrs[attr_key] = value
+
+
+_STORAGE_KWARGS = {'chunks', 'compression', 'compression_opts', 'shuffle',
+                   'fletcher32', 'scaleoffset'}   #: hdf5 only options ignored by NpyGroup
+
+
+class NpyAttrs(collections.MutableMapping):
+    '''
+    The attributes of an object in a :py:class:`NpyDirBackend` file,
+    kept in the 'attrs' entry of a JSON file and written out on every
+    change.
+    '''
+    def __init__(self, node):
+        self._node = node
+
+    def _read(self):
+        return dict((k, _json_decode(v)) for k, v in self._node._read_md()['attrs'].items())
+
+    def __getitem__(self, key):
+        return self._read()[key]
+
+    def __setitem__(self, key, value):
+        self._node._check_write()
+        md = self._node._read_md()
+        md['attrs'][key] = _json_encode(value)
+        self._node._write_md(md)
+
+    def __delitem__(self, key):
+        self._node._check_write()
+        md = self._node._read_md()
+        del md['attrs'][key]
+        self._node._write_md(md)
+
+    def __iter__(self):
+        return iter(self._node._read_md()['attrs'])
+
+    def __len__(self):
+        return len(self._node._read_md()['attrs'])
+
+
+class _NpyNode(object):
+    """Private base class of the groups and data sets of
+    :py:class:`NpyDirBackend`
+    """
+    def __init__(self, root, path):
+        self._root = root
+        self._path = path   # absolute path on disk, without extension for data sets
+
+    @property
+    def attrs(self):
+        return NpyAttrs(self)
+
+    def _check_write(self):
+        if not self._root._write:
+            raise IOError("file is read-only: {0}".format(self._root.filename))
+
+    def _read_md(self):
+        try:
+            with open(self._md_path) as f:
+                return json.load(f)
+        except IOError:
+            return {'attrs': {}}
+
+    def _write_md(self, md):
+        tmp = self._md_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(md, f)
+        os.rename(tmp, self._md_path)
+
+
+class NpyGroup(_NpyNode):
+    '''
+    A group of a :py:class:`NpyDirBackend` file, a directory.
+    '''
+    @property
+    def _md_path(self):
+        return os.path.join(self._path, '.attrs.json')
+
+    def _resolve(self, path):
+        if path.startswith('/'):
+            base, path = self._root._path, path.lstrip('/')
+        else:
+            base = self._path
+        parts = [p for p in path.split('/') if p]
+        return os.path.join(base, *parts) if parts else base
+
+    def __getitem__(self, path):
+        full = self._resolve(path)
+        if os.path.isdir(full):
+            return NpyGroup(self._root, full)
+        if os.path.isfile(full + '.npy'):
+            return NpyDataset(self._root, full)
+        raise KeyError("object {0} does not exist".format(path))
+
+    def __contains__(self, path):
+        full = self._resolve(path)
+        return os.path.isdir(full) or os.path.isfile(full + '.npy')
+
+    def keys(self):
+        names = []
+        for name in sorted(os.listdir(self._path)):
+            if name.startswith('.'):
+                continue
+            if os.path.isdir(os.path.join(self._path, name)):
+                names.append(name)
+            elif name.endswith('.npy'):
+                names.append(name[:-4])
+        return names
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __delitem__(self, path):
+        self._check_write()
+        obj = self[path]
+        if isinstance(obj, NpyGroup):
+            shutil.rmtree(obj._path)
+        else:
+            os.remove(obj._path + '.npy')
+            if os.path.isfile(obj._md_path):
+                os.remove(obj._md_path)
+
+    def move(self, source, dest):
+        self._check_write()
+        obj = self[source]
+        if dest in self:
+            raise ValueError("object {0} already exists".format(dest))
+        full = self._resolve(dest)
+        if not os.path.isdir(os.path.dirname(full)):
+            raise KeyError("parent of {0} does not exist".format(dest))
+        if isinstance(obj, NpyGroup):
+            os.rename(obj._path, full)
+        else:
+            # the side car first, so the data set never shows up without its attrs
+            if os.path.isfile(obj._md_path):
+                os.rename(obj._md_path, full + '.json')
+            os.rename(obj._path + '.npy', full + '.npy')
+
+    def require_group(self, path):
+        full = self._resolve(path)
+        if os.path.isfile(full + '.npy'):
+            raise TypeError("a data set exists at {0}".format(path))
+        if not os.path.isdir(full):
+            self._check_write()
+            os.makedirs(full)
+        return NpyGroup(self._root, full)
+
+    def create_dataset(self, name, shape=None, dtype=None, data=None,
+                       maxshape=None, fillvalue=None, **kwargs):
+        self._check_write()
+        unknown = set(kwargs) - _STORAGE_KWARGS
+        if unknown:
+            raise TypeError("unexpected arguments {0}".format(sorted(unknown)))
+        if name in self:
+            raise ValueError("object {0} already exists".format(name))
+        parent, base = os.path.split(name)
+        grp = self.require_group(parent) if parent else self
+        full = os.path.join(grp._path, base)
+
+        if data is not None:
+            data = np.asarray(data, dtype=dtype)
+            np.save(full + '.npy', data)
+            shape = data.shape
+        else:
+            arr = np.lib.format.open_memmap(full + '.npy', mode='w+',
+                                            dtype=np.dtype(dtype), shape=tuple(shape))
+            if fillvalue is not None and arr.size:
+                arr[...] = fillvalue
+            del arr
+        dset = NpyDataset(self._root, full)
+        md = {'attrs': {}}
+        if maxshape is not None:
+            md['maxshape'] = list(maxshape)
+        dset._write_md(md)
+        return dset
+
+
+class NpyRoot(NpyGroup):
+    '''
+    The root group of a :py:class:`NpyDirBackend` file.
+    '''
+    def __init__(self, path, write):
+        self._root = self
+        self._path = os.path.abspath(path)
+        self._write = write
+        self.filename = path
+
+    def flush(self):
+        # every write goes straight to the files
+        pass
+
+    def close(self):
+        pass
+
+
+class NpyDataset(_NpyNode):
+    '''
+    A data set of a :py:class:`NpyDirBackend` file, a `.npy` file.
+    Reads return read-only memory maps of the file.
+    '''
+    @property
+    def _md_path(self):
+        return self._path + '.json'
+
+    def _load(self, mode='r'):
+        try:
+            return np.load(self._path + '.npy', mmap_mode=mode)
+        except ValueError:
+            # empty arrays can not be memory mapped
+            return np.load(self._path + '.npy')
+
+    @property
+    def shape(self):
+        return self._load().shape
+
+    @property
+    def dtype(self):
+        return self._load().dtype
+
+    @property
+    def maxshape(self):
+        maxshape = self._read_md().get('maxshape')
+        return self.shape if maxshape is None else tuple(maxshape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, sel):
+        return self._load()[sel]
+
+    def __setitem__(self, sel, value):
+        self._check_write()
+        arr = self._load('r+')
+        arr[sel] = value
+        if isinstance(arr, np.memmap):
+            arr.flush()
+
+    def resize(self, shape):
+        '''Changes the size of the first axis, growing in place if
+        possible
+        '''
+        self._check_write()
+        shape = tuple(shape)
+        old = self._load()
+        if shape[1:] != old.shape[1:]:
+            raise ValueError("only the first axis can be resized")
+        if shape[0] > old.shape[0] and _grow_npy(self._path + '.npy', old, shape):
+            return
+        new = np.zeros(shape, dtype=old.dtype)
+        n = min(shape[0], old.shape[0])
+        new[:n] = old[:n]
+        del old
+        with open(self._path + '.npy.tmp', 'wb') as f:
+            np.save(f, new)
+        os.rename(self._path + '.npy.tmp', self._path + '.npy')
+
+
+def _grow_npy(fname, old, shape):
+    """Private function to grow the first axis of a C ordered `.npy`
+    file in place by re-writing the header and zero extending the
+    file.  Returns `False` if the new header does not fit in the space
+    of the old one.
+    """
+    if old.ndim and not old.flags.c_contiguous:
+        return False
+    header = {'descr': np.lib.format.dtype_to_descr(old.dtype),
+              'fortran_order': False,
+              'shape': shape}
+    with open(fname, 'r+b') as f:
+        np.lib.format.read_magic(f)
+        np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+        f.seek(0)
+        np.lib.format.write_array_header_1_0(f, header)
+        if f.tell() != offset:
+            # restore the old header
+            f.seek(0)
+            np.lib.format.write_array_header_1_0(
+                f, {'descr': header['descr'], 'fortran_order': False, 'shape': old.shape})
+            return False
+        f.truncate(offset + int(np.prod(shape)) * old.dtype.itemsize)
+    return True
+
+
+def _json_encode(value):
+    """Private function to turn an attribute value into something JSON
+    can store.  Arrays (and lists) are stored as base64 encoded bytes
+    so they come back with the same dtype.
+    """
+    if isinstance(value, (list, tuple)):
+        value = np.asarray(value)
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return {'__ndarray__': base64.b64encode(value.tobytes()).decode('ascii'),
+                'dtype': value.dtype.str,
+                'shape': list(value.shape)}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, complex):
+        return {'__complex__': [value.real, value.imag]}
+    return value
+
+
+def _json_decode(value):
+    """Private function to invert :py:func:`_json_encode`
+    """
+    if isinstance(value, dict):
+        if '__ndarray__' in value:
+            data = base64.b64decode(value['__ndarray__'])
+            return np.frombuffer(data, dtype=np.dtype(str(value['dtype']))).reshape(value['shape']).copy()
+        if '__complex__' in value:
+            return complex(*value['__complex__'])
+    if isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    return value
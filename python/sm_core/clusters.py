@@ -0,0 +1,376 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import time
+import itertools
+import multiprocessing
+import numpy as np
+
+'''
+Clusters (connected components) of particles closer than a cutoff.
+
+The pairs closer than the cutoff are found with a cell list: the
+particles are sorted by cell and, for each of the neighboring cell
+offsets in turn, the candidate pairs are generated and filtered as
+arrays.  Only the occupied cells are stored, so sparse frames cost
+nothing extra.  The components are labeled with a vectorized
+union-find: each round every root hooks onto the smallest root it is
+bonded to and the trees are compressed by pointer jumping, which takes
+a number of rounds logarithmic in the cluster size.  A frame of 10^6
+particles takes 1.5 s in 2D and 3 s in 3D on one core, the frames are
+spread over worker processes.
+'''
+
+_MAX_PAIRS = 2 ** 22   #: most candidate pairs held in memory at once
+
+
+def find_bonds(positions, cutoff, box=None):
+    '''Finds the pairs of particles closer than `cutoff`
+
+    Parameters
+    ----------
+    positions : :py:class:`~numpy.ndarray`
+        (N, d) array of positions
+    cutoff : float
+        the largest distance of bonded particles
+    box : sequence of float or :py:class:`None`
+        the length of the periodic box in each dimension, `None` for
+        open boundaries
+
+    Returns
+    -------
+    i, j : :py:class:`~numpy.ndarray`
+        indices of the bonded particles, each pair once with `i < j`
+    '''
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim != 2:
+        raise ValueError("positions must be an (N, d) array")
+    if not cutoff > 0:
+        raise ValueError("cutoff must be positive")
+    n, dim = positions.shape
+    if box is not None:
+        box = np.asarray(box, dtype=np.float64)
+        if box.shape != (dim,):
+            raise ValueError("need one box length per dimension")
+        positions = positions % box
+        n_cells = np.maximum((box // cutoff).astype(np.int64), 1)
+        cell = np.minimum((positions / (box / n_cells)).astype(np.int64), n_cells - 1)
+    else:
+        low = positions.min(axis=0) if n else np.zeros(dim)
+        cell = ((positions - low) // cutoff).astype(np.int64)
+        n_cells = cell.max(axis=0) + 1 if n else np.ones(dim, dtype=np.int64)
+    # linear cell index, row major
+    strides = np.ones(dim, dtype=np.int64)
+    for d in range(dim - 2, -1, -1):
+        strides[d] = strides[d + 1] * n_cells[d + 1]
+
+    key = cell.dot(strides)
+    order = np.argsort(key)
+    key = key[order]
+    positions = positions[order]
+    starts = np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1]])) if n else np.zeros(0, np.intp)
+    cells = key[starts]
+    counts = np.diff(np.append(starts, n))
+    cell_coords = cell[order][starts]
+    # cell of each particle, as an index into `cells`
+    slot = np.repeat(np.arange(len(cells)), counts)
+    n_total = int(np.prod(n_cells))
+    if n_total <= 4 * n:
+        # few enough cells for a table from cell to index into `cells`
+        table = np.full(n_total, -1, dtype=np.intp)
+        table[cells] = np.arange(len(cells))
+    else:
+        table = None
+    coords = [np.ascontiguousarray(positions[:, d]) for d in range(dim)]
+
+    bonds_i = []
+    bonds_j = []
+    for offset in _half_shell(dim):
+        if not any(offset):
+            # the same cell, the particles after this one
+            first = np.arange(1, n + 1)
+            count = starts[slot] + counts[slot] - first
+        else:
+            nbr = cell_coords + offset
+            if box is not None:
+                nbr %= n_cells
+                valid = np.ones(len(cells), dtype=bool)
+            else:
+                valid = np.all((nbr >= 0) & (nbr < n_cells), axis=1)
+            nbr_key = nbr.dot(strides)
+            if table is not None:
+                idx = table[np.where(valid, nbr_key, 0)]
+                valid &= idx >= 0
+            else:
+                idx = np.minimum(np.searchsorted(cells, nbr_key), len(cells) - 1)
+                valid &= cells[idx] == nbr_key
+            first = starts[idx][slot]
+            count = np.where(valid, counts[idx], 0)[slot]
+        for i, j in _candidates(first, count):
+            r2 = np.zeros(len(i))
+            for d, x in enumerate(coords):
+                delta = x[j] - x[i]
+                if box is not None:
+                    delta -= box[d] * np.rint(delta / box[d])
+                r2 += delta * delta
+            keep = r2 <= cutoff * cutoff
+            keep &= i != j
+            bonds_i.append(i[keep])
+            bonds_j.append(j[keep])
+
+    i = order[np.concatenate(bonds_i)] if bonds_i else np.zeros(0, dtype=np.intp)
+    j = order[np.concatenate(bonds_j)] if bonds_j else np.zeros(0, dtype=np.intp)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    if box is not None and np.any(n_cells < 3):
+        # with fewer than 3 cells along a periodic dimension two offsets
+        # can lead to the same cell, and a cell can be its own neighbor
+        pair = np.unique(i * n + j)
+        i, j = pair // n, pair % n
+    return i, j
+
+
+def label_clusters(n, i, j):
+    '''Labels the connected components of a graph
+
+    Parameters
+    ----------
+    n : int
+        number of nodes
+    i, j : :py:class:`~numpy.ndarray`
+        the edges
+
+    Returns
+    -------
+    labels : :py:class:`~numpy.ndarray`
+        the component of each node, numbered from 0 in the order of
+        their lowest node
+    '''
+    parent = np.arange(n)
+    i = np.asarray(i, dtype=np.intp)
+    j = np.asarray(j, dtype=np.intp)
+    while len(i):
+        root_i = parent[i]
+        root_j = parent[j]
+        cross = root_i != root_j
+        if not np.any(cross):
+            break
+        # only the edges between different trees are needed again
+        i = i[cross]
+        j = j[cross]
+        root_i = root_i[cross]
+        root_j = root_j[cross]
+        # hook the larger root onto the smaller one, when several edges
+        # hook the same root any of them will do
+        parent[np.maximum(root_i, root_j)] = np.minimum(root_i, root_j)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return np.unique(parent, return_inverse=True)[1]
+
+
+def find_clusters(positions, cutoff, box=None):
+    '''Finds the clusters of particles closer than `cutoff`, see
+    :py:func:`find_bonds` for the arguments.
+
+    Returns
+    -------
+    cluster_id : :py:class:`~numpy.ndarray`
+        the cluster of each particle, numbered from 0 in the order of
+        their first particle
+    '''
+    positions = np.asarray(positions)
+    i, j = find_bonds(positions, cutoff, box)
+    return label_clusters(len(positions), i, j)
+
+
+def size_histogram(cluster_id):
+    '''Returns the number of clusters of each size, indexed by size
+    '''
+    return np.bincount(np.bincount(cluster_id)) if len(cluster_id) else np.zeros(1, dtype=np.intp)
+
+
+def clusters(sms, cutoff, columns=('x', 'y'), box=None, frames=None, name='cluster_id',
+             hist_name='cluster_size', n_workers=None, over_write=False):
+    '''Finds the clusters in each frame.  The cluster of each particle
+    is stored in `/time_*/particles/name`, the number of clusters of
+    each size in `/time_*/statistics/hist_name` and the sum over the
+    frames in the run level statistics `/statistics/hist_name`.
+
+    Parameters
+    ----------
+    sms : `~sm_core.data_serialization.SM_serial`
+        file to read from and write to
+    cutoff : float
+        the largest distance of bonded particles
+    columns : :py:class:`list` of :py:class:`str`
+        names of the position data sets, one per dimension
+    box : sequence of float or :py:class:`None`
+        the length of the periodic box in each dimension, `None` for
+        open boundaries
+    frames : iterable of int or :py:class:`None`
+        frames to use, defaults to all frames
+    name : :py:class:`str`
+        name of the per particle data set
+    hist_name : :py:class:`str`
+        name of the cluster size histograms
+    n_workers : int or :py:class:`None`
+        number of worker processes, defaults to the number of cpus.
+        With 1 the frames are done in this process
+    over_write : bool
+        if existing results should be over written
+
+    Returns
+    -------
+    hist : :py:class:`~numpy.ndarray`
+        the number of clusters of each size, summed over the frames
+    '''
+    if box is not None and len(box) != len(columns):
+        raise ValueError("need one column per dimension of the box")
+    frames = sms.list_frames() if frames is None else list(frames)
+    if not frames:
+        raise ValueError("no frames to find clusters in")
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(1, min(n_workers, len(frames)))
+    if not over_write:
+        # check everything up front, so nothing is half written
+        for frame in frames:
+            if (_exists(sms.get_dset_md, frame, name) or
+                    _exists(sms.loads_frame_stat, frame, hist_name)):
+                raise RuntimeError("frame {0} already has cluster results, "
+                                   "trying to over-write them".format(frame))
+        if _exists(sms.get_run_stat_md, hist_name):
+            raise RuntimeError("trying to over-write existing statistics {0}".format(hist_name))
+    md = {'algorithm': 'cell list union-find',
+          'columns': ','.join(columns),
+          'cutoff': float(cutoff),
+          'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'writer': 'sm_core/python sm_core.clusters'}
+    if box is not None:
+        md['box'] = np.asarray(box, dtype=np.float64)
+
+    def read(frame):
+        return np.column_stack([sms.loads(frame, col) for col in columns]), cutoff, box
+
+    if n_workers == 1:
+        results = (_cluster_frame(read(frame)) for frame in frames)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_workers)
+        results = _in_order(pool, frames, read, 2 * n_workers)
+
+    total = np.zeros(1, dtype=np.int64)
+    try:
+        for frame, cluster_id in itertools.izip(frames, results):
+            hist = size_histogram(cluster_id)
+            frame_md = dict(md)
+            frame_md['n_clusters'] = int(cluster_id.max()) + 1 if len(cluster_id) else 0
+            sms.dumps(frame, name, cluster_id, meta_data=frame_md, over_write=over_write)
+            sms.dumps_frame_stat(frame, hist_name, hist, meta_data=frame_md, over_write=over_write)
+            if len(hist) > len(total):
+                total = np.concatenate([total, np.zeros(len(hist) - len(total), dtype=np.int64)])
+            total[:len(hist)] += hist
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    md['n_frames'] = len(frames)
+    md['first_frame'] = min(frames)
+    md['last_frame'] = max(frames)
+    sms.dumps_run_stat(hist_name, total, meta_data=md, over_write=over_write)
+    return total
+
+
+def _exists(func, *args):
+    """Private function returning if `func(*args)` finds what it
+    looks up, that is does not raise `KeyError`
+    """
+    try:
+        func(*args)
+    except KeyError:
+        return False
+    return True
+
+
+def _in_order(pool, frames, read, n_ahead):
+    """Private generator of the cluster ids of `frames`, computed in
+    `pool` with at most `n_ahead` frames read ahead.
+    """
+    pending = []
+    frames = iter(frames)
+    for frame in itertools.islice(frames, n_ahead):
+        pending.append(pool.apply_async(_cluster_frame, (read(frame),)))
+    while pending:
+        res = pending.pop(0).get()
+        for frame in itertools.islice(frames, 1):
+            pending.append(pool.apply_async(_cluster_frame, (read(frame),)))
+        yield res
+
+
+def _cluster_frame(args):
+    """Private function computing the clusters of one frame, run in
+    the worker processes
+    """
+    positions, cutoff, box = args
+    return find_clusters(positions, cutoff, box).astype(np.int32)
+
+
+def _half_shell(dim):
+    """Private function returning the offsets to the neighboring cells
+    which, together with their negatives, cover all of them once:
+    the zero offset and those whose first non-zero entry is positive.
+    """
+    offsets = []
+    for offset in itertools.product((-1, 0, 1), repeat=dim):
+        nonzero = [o for o in offset if o]
+        if not nonzero or nonzero[0] > 0:
+            offsets.append(np.array(offset, dtype=np.int64))
+    return offsets
+
+
+def _candidates(first, count):
+    """Private generator of the candidate pairs: particle `k` is paired
+    with particles `first[k]` to `first[k] + count[k] - 1`.  The pairs
+    come in blocks of about `_MAX_PAIRS`.
+    """
+    total = np.cumsum(count)
+    start = 0
+    while start < len(count):
+        done = total[start - 1] if start else 0
+        stop = max(start + 1, np.searchsorted(total, done + _MAX_PAIRS, side='right'))
+        c = count[start:stop]
+        i = np.repeat(np.arange(start, stop), c)
+        # position of each pair in its particle's run
+        run = np.arange(len(i)) - np.repeat(np.cumsum(c) - c, c)
+        j = np.repeat(first[start:stop], c) + run
+        yield i, j
+        start = stop
@@ -27,9 +27,19 @@
 #of the authors and should not be interpreted as representing official policies,
 #either expressed or implied, of the FreeBSD Project.
 #
-import h5py
 import os.path
-import numpy as np
+import json
+import bisect
+import threading
+import itertools
+import contextlib
+import collections
+from sm_core import _lazy
+from sm_core import backends
+
+np = _lazy.lazy_import('numpy')
+
+_memory_tokens = itertools.count()   #: cache names of in-memory files
 
 '''
 /time_{07d}
@@ -47,6 +57,21 @@ import numpy as np
    /.
 /parameters
   static parameters
+/series
+   /x
+      /data          particle-major copy of /time_*/particles/x
+      /frames
+      /particle_ids
+   /...
+/summary
+   /x                per-frame reductions of /time_*/particles/x
+   /...
+/statistics
+   /msd              run level statistics
+   /...
+/_journal
+   /{n}              writes of a transaction that has not finished
+/_series_build       series being built by build_series
 
 '''
 
@@ -63,6 +88,7 @@ class SM_serial(object):
 
     '''
     _VALID_FILE_MODES = {'r', 'r+', 'w', 'w-', 'a'}   #: valid file modes
+    _VALID_BACKENDS = {'hdf5', 'memory', 'npy'}   #: valid backends
 
     def _format_frame_name(self, N, post_fix=None):
         '''Private function to format the name for the
@@ -86,7 +112,7 @@ class SM_serial(object):
         return base
 
     @classmethod
-    def open(cls, fname, fmode):
+    def open(cls, fname, fmode, backend=None, write_through=False, cache=None):
         """
         Parameters
         ----------
@@ -106,10 +132,34 @@ class SM_serial(object):
 
 
            Defaults to 'a'
+        backend : :py:class:`str` or :py:class:`None`
+           in the set {'hdf5', 'memory', 'npy'}
+
+           'memory' keeps the whole file in memory (the HDF5 core
+           driver), an existing file is read in when it is opened.
+           Use :py:func:`to_bytes` to get a snapshot of the file.
+
+           'npy' stores the file as a directory tree of `.npy` files,
+           reads return read-only memory maps.  See
+           :py:mod:`sm_core.backends`, which also has a converter
+           between the formats.
+
+           Defaults to 'hdf5'
+        write_through : bool
+           only for the 'memory' backend, if the file should be
+           written to `fname` when it is closed
+        cache : `ArrayCache` or :py:class:`None`
+           cache for the arrays returned by :py:func:`loads`, see
+           :py:func:`set_cache`
         """
 
         if fmode is None:
             fmode = 'a'
+        if backend is None:
+            backend = 'hdf5'
+        if backend not in cls._VALID_BACKENDS:
+            raise ValueError("invalid backend {0}".format(backend))
+        _backend = backends.get_backend(backend)
 
         # TODO add brains to keep track if the objcet is writable and raise
         # reasonable errors
@@ -117,36 +167,86 @@ class SM_serial(object):
             print "invalid mode, converting to 'a'"
             fmode = 'a'
         new_file = False
-        if (not os.path.isfile(fname) and fmode == 'a') or fmode == 'w':
+        if (not _backend.exists(fname) and fmode == 'a') or fmode == 'w':
             # we are creating a new file !
             new_file = True
 
-        _file = h5py.File(fname, fmode)  # modulo patching up fmode
+        _file = _backend.open(fname, fmode, write_through)  # modulo patching up fmode
         if new_file:
             _file.attrs['version'] = '0.1_chi'
             _file.attrs['writer'] = 'sm_core/python'
             _file.require_group('parameters')
         write_flag = fmode != 'r'
-        return cls(_file, write_flag)
+        sms = cls(_file, write_flag, _backend)
+        if cache is not None:
+            sms.set_cache(cache)
+        return sms
+
+    @classmethod
+    def from_bytes(cls, image, fmode='r'):
+        """Opens an in-memory copy of a file from its bytes, as
+        returned by :py:func:`to_bytes`
+
+        Parameters
+        ----------
+        image : :py:class:`str`
+            the contents of the file
+        fmode : :py:class:`str`
+            'r' or 'r+', changes are never written back to `image`
+        """
+
+        if fmode not in ('r', 'r+'):
+            raise ValueError("fmode must be 'r' or 'r+'")
+        _backend = backends.get_backend('memory')
+        _file = _backend.open_image(image, fmode)
+        return cls(_file, fmode == 'r+', _backend)
+
+    def to_bytes(self):
+        '''Returns a snapshot of the whole file
 
-    def __init__(self, file_obj, write_flg):
+        Returns
+        -------
+        image : :py:class:`str`
+            the contents of the file, see :py:func:`from_bytes`
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        return self._backend.to_bytes(self._file)
+
+    def __init__(self, file_obj, write_flg, backend=None):
         '''Init function.  You should use the py:func:`open` class method.
 
         Parameters
         ----------
         file : `h5py.File`
-            `h5py.File` object to use and the backing store
+            `h5py.File` object (or root group of `backend`) to use and the backing store
         write_flg: `bool`
             if the backing file is write-able
+        backend : `~sm_core.backends.Backend` or :py:class:`None`
+            the backend `file` comes from, defaults to hdf5
 
         '''
         self._file = file_obj
         self._write = write_flg
+        if backend is None:
+            backend = backends.get_backend('hdf5')
+        self._backend = backend
         if 'version' in self._file.attrs:
             self._version = self._file.attrs['version']
         else:
             self._version = None
+        self._cache = None
+        self._cache_name = None
+        self._delta_policy = {}
+        self._keyframes = {}
+        self._precision_policy = {}
+        self._summary_policy = {}
+        self._summary_rows = {}
+        self._txn = None
         self._open = True
+        if self._write and '_journal' in self._file:
+            self._recover()
 
     def __del__(self):
         self.close()
@@ -160,7 +260,89 @@ class SM_serial(object):
             self._file.close()
             self._open = False
 
-    def loads(self, frame_num, data_set):
+    def set_cache(self, cache):
+        '''Cache the arrays returned by :py:func:`loads`.
+
+        With a cache `loads` returns read-only arrays.  Entries are
+        dropped when the same (frame, data set) is written with
+        :py:func:`dumps`.  One cache can be shared by several objects,
+        entries are keyed on the path of the file so objects opened on
+        the same file (read-only, or the one writer) share them.
+
+        Parameters
+        ----------
+        cache : `ArrayCache` or :py:class:`None`
+            the cache to use, `None` to stop caching
+        '''
+        self._cache = cache
+        if self._backend.name == 'memory':
+            # in-memory files are private to this object, ids of freed
+            # objects get reused so take a token that never is
+            self._cache_name = ('memory', next(_memory_tokens))
+        else:
+            self._cache_name = os.path.realpath(self._file.filename)
+
+    def flush(self):
+        '''Flushes the backing file to disk
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        self._file.flush()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Context manager which groups the writes made in its block
+        into one commit::
+
+            with sms.transaction():
+                for j, frame in enumerate(frames):
+                    sms.dumps(j, 'x', frame.x)
+                    sms.set_frame_md(j, {'dt': frame.dt})
+
+        :py:func:`dumps`, :py:func:`set_frame_md` and
+        :py:func:`update_dset_md` are staged under `/_journal` and
+        only moved into place, followed by a single flush, when the
+        block exits.  Until then they are not visible to reads.  If
+        the block raises, the staged writes are dropped.
+
+        If the process dies before the commit starts, the staged
+        writes are dropped the next time the file is opened for
+        writing, if it dies during the commit, the commit is finished
+        then.  The summary tables (see :py:func:`set_summary`) are
+        updated after the data sets are in place, an interrupted
+        commit may leave them missing rows.
+
+        Transactions can not be nested.
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        if not self._write:
+            raise RuntimeError("trying to write to a read-only file")
+        if self._txn is not None:
+            raise RuntimeError("transactions can not be nested")
+
+        journal = self._require_grp('_journal')
+        n = 0
+        while str(n) in journal:
+            n += 1
+        path = '_journal/{0}'.format(n)
+        self._require_grp(path).attrs['state'] = 'open'
+        txn = self._txn = _Transaction(path)
+        try:
+            yield
+        except:
+            self._txn = None
+            # the keyframe cache may hold keyframes which were never committed
+            self._keyframes.clear()
+            del self._file[path]
+            self._drop_journal()
+            raise
+        self._txn = None
+        self._commit(txn)
+
+    def loads(self, frame_num, data_set, out=None):
         '''Reads the given data set from the given frame.
 
         Parameters
@@ -169,17 +351,68 @@ class SM_serial(object):
             The number of the frame to get the data from
         data_set : :py:class:`str`
             a string that is the name of the data set to get
+        out : :py:class:`~numpy.ndarray` or :py:class:`None`
+            if given, the data is read into this (C contiguous) array
+            instead of a new one.  It must have the shape and dtype of
+            the data set, raises `ValueError` if not.  Any buffer works,
+            for example shared memory
 
         Returns
         -------
         ret :  :py:class:`~numpy.ndarray`
-            data is dataset
+            data is dataset, `out` if given
         '''
 
         if not self._open:
             raise RuntimeError("Trying to operate on a closed file")
+        if self._cache is not None:
+            key = (self._cache_name, frame_num, data_set)
+            ret = self._cache.get(key)
+            if ret is not None:
+                if out is None:
+                    return ret
+                _check_out(out, ret.shape, ret.dtype)
+                out[...] = ret
+                return out
         # TODO add error checking so the raw h5 errors don't propagate up
-        return self._file[self._format_frame_name(frame_num, 'particles')][data_set][:]
+        dset = self._file[self._format_frame_name(frame_num, 'particles')][data_set]
+        ret = self._decode(data_set, dset, out)
+        if self._cache is not None:
+            if out is not None:
+                # the cache keeps its own copy, the caller owns `out`
+                self._cache.put(key, out.copy())
+                return out
+            self._cache.put(key, ret)
+            return ret.view()
+        return ret
+
+    def iterloads(self, data_set, frames=None, out=None):
+        '''Iterates over a data set in many frames.
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            a string that is the name of the data set to get
+        frames : iterable of int or :py:class:`None`
+            frames to read, defaults to all frames in the file
+        out : :py:class:`~numpy.ndarray` or :py:class:`None`
+            if given, every frame is read into this array (see
+            :py:func:`loads`), so the data set must have the same shape
+            in every frame and each array yielded is only valid until
+            the next one is read
+
+        Yields
+        ------
+        frame_num : int
+            the frame number
+        ret :  :py:class:`~numpy.ndarray`
+            data is dataset
+        '''
+
+        if frames is None:
+            frames = self.list_frames()
+        for frame_num in frames:
+            yield frame_num, self.loads(frame_num, data_set, out=out)
 
     def dumps(self, frame_num, data_set, data, meta_data=None, over_write=False, **kwargs):
         '''Adds data to the file.  The meta-data is associated with the data set.
@@ -198,6 +431,14 @@ class SM_serial(object):
             meta-data to be stored with the data set
         overwrite : bool
             if existing data should be over written, defaults to False
+
+        If delta encoding has been enabled for `data_set` (see
+        :py:func:`set_delta_encoding`) floating point data is stored as
+        either a keyframe or quantized deltas against the most recent
+        keyframe.  Over-writing a keyframe that other frames depend on
+        raises `RuntimeError`.
+
+        Use :py:func:`transaction` to make a group of writes atomic.
         '''
 
         if not self._open:
@@ -207,26 +448,178 @@ class SM_serial(object):
 
         # this needs to make sure the file is never left in a bad state
         data = np.asarray(data)
+        if self._cache is not None:
+            self._cache.invalidate((self._cache_name, frame_num, data_set))
+        if self._txn is not None:
+            self._stage_dumps(frame_num, data_set, data, meta_data, over_write, **kwargs)
+            return
         grp = self._require_grp(self._format_frame_name(frame_num, 'particles'))
         try:
             dset = grp[data_set]
         except KeyError:
             # this is the main behavior, it creates data set
-            dset = grp.create_dataset(data_set, data=data, **kwargs)
+            dset = self._create_dset(grp, frame_num, data_set, data, **kwargs)
         else:
             if over_write:
-                if not isinstance(dset, h5py._hl.dataset.Dataset):
+                if not self._backend.is_dataset(dset):
                     # TODO use custom class for this exception
                     raise RuntimeError("there is a group (not a dataset) where the data set needs to go."
                                        "Check names and that file is valid")
+                self._check_keyframe_dependents(frame_num, data_set, dset)
                 # delete the existing data set
                 del grp[data_set]
-                dset = grp.create_dataset(data_set, data=data, **kwargs)
+                cached = self._keyframes.get(data_set)
+                if cached is not None and cached[0] == frame_num:
+                    del self._keyframes[data_set]
+                dset = self._create_dset(grp, frame_num, data_set, data, **kwargs)
         if meta_data:
             # dump the meta-data
             for key, value in meta_data.items():
                 dset.attrs[key] = value
 
+    def set_delta_encoding(self, data_set, keyframe_interval, max_error):
+        '''Enable temporal delta encoding for a data set.
+
+        Every `keyframe_interval` frames the full array is stored as a
+        keyframe, in between only the difference from the most recent
+        keyframe is stored, quantized to integers.  The absolute error
+        of the decoded values is bounded by `max_error`, the actual
+        error of each frame is recorded in the 'sm_error' attribute of
+        the data set.  Only floating point data is delta encoded.
+
+        :py:func:`loads` decodes transparently.  The setting only
+        applies to this object and is not stored in the file.
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            name of the data set
+        keyframe_interval : int
+            maximum number of frames between keyframes, 1 disables
+            the deltas
+        max_error : float
+            bound on the absolute error of the decoded data
+        '''
+        if data_set in self._precision_policy:
+            raise ValueError("{0} already has a storage precision set".format(data_set))
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+        if max_error <= 0:
+            raise ValueError("max_error must be positive")
+        self._delta_policy[data_set] = (int(keyframe_interval), float(max_error))
+
+    def set_storage_precision(self, data_set, mode, max_error=None, offset=None):
+        '''Set a lossy storage precision for a data set.
+
+        ========  ===================================================
+        float32   store float64 data as float32
+        fixed     store floating point data as unsigned integers
+                  (the smallest type that fits) times a scale plus an
+                  offset, with an absolute error of at most `max_error`
+        ========  ===================================================
+
+        The scale and offset, the actual error and the logical dtype
+        are kept in the attributes of the data set ('sm_*') and
+        :py:func:`loads` decodes back to the logical dtype.  Only
+        floating point data is affected.  Frames that can not be
+        encoded are stored unchanged: for 'float32' frames with values
+        outside of the float32 range, for 'fixed' frames with
+        non-finite values, with more than 2**53 steps of size
+        2 * `max_error` above the offset or whose error would exceed
+        `max_error`.  The setting only applies to this object and is
+        not stored in the file, it can not be combined with
+        :py:func:`set_delta_encoding`.
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            name of the data set
+        mode : :py:class:`str`
+            in the set {'float32', 'fixed'}
+        max_error : float or :py:class:`None`
+            bound on the absolute error, needed for 'fixed'
+        offset : float or :py:class:`None`
+            for 'fixed', the value stored as 0.  Defaults to the
+            minimum of each frame
+        '''
+        if data_set in self._delta_policy:
+            raise ValueError("{0} is already delta encoded".format(data_set))
+        if mode == 'fixed':
+            if max_error is None or max_error <= 0:
+                raise ValueError("'fixed' needs a positive max_error")
+            max_error = float(max_error)
+        elif mode != 'float32':
+            raise ValueError("invalid storage precision {0}".format(mode))
+        self._precision_policy[data_set] = (mode, max_error, offset)
+
+    def set_summary(self, data_set, bins=None, hist_range=None):
+        '''Enable per-frame summary statistics for a data set.
+
+        When the data set is written with :py:func:`dumps` the count,
+        min, max, mean and variance of its finite values, and
+        optionally a fixed-bin histogram, are computed while the array
+        is still in memory and stored as one row of the table
+        `/summary/data_set`.  Read the table with
+        :py:func:`get_summary`.  The setting only applies to this
+        object and is not stored in the file.
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            name of the data set
+        bins : int, array of bin edges or :py:class:`None`
+            histogram bins, `None` for no histogram.  An int needs
+            `hist_range`
+        hist_range : (float, float) or :py:class:`None`
+            range of the histogram if `bins` is an int
+        '''
+        if bins is None:
+            edges = None
+        elif np.ndim(bins) == 0:
+            if hist_range is None:
+                raise ValueError("hist_range is needed if bins is an int")
+            edges = np.linspace(hist_range[0], hist_range[1], int(bins) + 1)
+        else:
+            edges = np.asarray(bins, dtype=np.float64)
+            if edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0):
+                raise ValueError("bins must be increasing bin edges")
+
+        if self._open and 'summary/' + data_set in self._file:
+            old_edges = self._file['summary/' + data_set].attrs.get('bin_edges')
+            if not ((edges is None and old_edges is None) or
+                    (edges is not None and old_edges is not None and
+                     np.array_equal(edges, old_edges))):
+                raise ValueError("bins do not match the existing summary of {0}".format(data_set))
+        self._summary_policy[data_set] = edges
+
+    def get_summary(self, data_set, frames=None):
+        '''Returns the per-frame summary statistics of a data set
+        recorded by :py:func:`dumps` (see :py:func:`set_summary`).
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            name of the data set
+        frames : iterable of int or :py:class:`None`
+            frames to return, defaults to all recorded frames
+
+        Returns
+        -------
+        ret : :py:class:`~numpy.ndarray`
+            record array sorted by frame with the fields 'frame',
+            'count', 'min', 'max', 'mean', 'var' and, if bins were
+            given, 'hist'.  The bin edges are in the 'bin_edges'
+            attribute of the table.
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        table = self._file['summary/' + data_set][:]
+        table = table[np.argsort(table['frame'], kind='mergesort')]
+        if frames is not None:
+            table = table[np.in1d(table['frame'], np.asarray(frames))]
+        return table
+
     def update_dset_md(self, frame_num, dset_name, meta_data, over_write=False):
         '''Update the meta-data on a dataset.
 
@@ -247,6 +640,14 @@ class SM_serial(object):
         if not self._write:
             raise RuntimeError("trying to write to a read-only file")
 
+        if self._txn is not None:
+            path = self._format_frame_name(frame_num, 'particles') + '/' + dset_name
+            if path in self._txn.staged:
+                obj = self._file[self._txn.staged[path]]
+            else:
+                obj = self._file[path]
+            self._stage_md(path, obj, meta_data, over_write)
+            return
         grp = self._require_grp(self._format_frame_name(frame_num, 'particles'))
         _object_set_md(grp[dset_name], meta_data, over_write)
 
@@ -268,9 +669,124 @@ class SM_serial(object):
         if not self._write:
             raise RuntimeError("trying to write to a read-only file")
 
+        if self._txn is not None:
+            path = self._format_frame_name(frame_num, 'particles')
+            obj = self._file[path] if path in self._file else None
+            self._stage_md(path, obj, meta_data, over_write)
+            return
         grp = self._require_grp(self._format_frame_name(frame_num, 'particles'))
         _object_set_md(grp, meta_data, over_write)
 
+    def dumps_frame_stat(self, frame_num, name, data, meta_data=None, over_write=False, **kwargs):
+        '''Adds per-frame statistics (like S(k) or g(r)) to
+        `/time_*/statistics`.
+
+        additional kwargs are passed to backing structure
+
+        Parameters
+        ----------
+        frame_num : int
+            the frame to insert the data into
+        name : :py:class:`str`
+            name of the data set
+        data : :py:class:`~numpy.ndarray`
+            the data to store
+        meta_data : :py:class:`dict` like or :py:class:`None`
+            meta-data to be stored with the data set
+        over_write : bool
+            if existing data should be over written, raises
+            `RuntimeError` if False and the data set exists
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        if not self._write:
+            raise RuntimeError("trying to write to a read-only file")
+
+        self._dumps_stat(self._format_frame_name(frame_num, 'statistics'),
+                         name, data, meta_data, over_write, **kwargs)
+
+    def loads_frame_stat(self, frame_num, name):
+        '''Reads per-frame statistics from `/time_*/statistics`
+
+        Parameters
+        ----------
+        frame_num : int
+            The number of the frame to get the data from
+        name : :py:class:`str`
+            name of the data set
+
+        Returns
+        -------
+        ret :  :py:class:`~numpy.ndarray`
+            data is dataset
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        return self._file[self._format_frame_name(frame_num, 'statistics')][name][:]
+
+    def dumps_run_stat(self, name, data, meta_data=None, over_write=False, **kwargs):
+        '''Adds run level statistics (results computed from many frames,
+        like the msd) to `/statistics`.
+
+        additional kwargs are passed to backing structure
+
+        Parameters
+        ----------
+        name : :py:class:`str`
+            name of the data set, relative to `/statistics`
+        data : :py:class:`~numpy.ndarray`
+            the data to store
+        meta_data : :py:class:`dict` like or :py:class:`None`
+            meta-data to be stored with the data set
+        over_write : bool
+            if existing data should be over written, raises
+            `RuntimeError` if False and the data set exists
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        if not self._write:
+            raise RuntimeError("trying to write to a read-only file")
+
+        self._dumps_stat('statistics', name, data, meta_data, over_write, **kwargs)
+
+    def loads_run_stat(self, name):
+        '''Reads run level statistics from `/statistics`
+
+        Parameters
+        ----------
+        name : :py:class:`str`
+            name of the data set, relative to `/statistics`
+
+        Returns
+        -------
+        ret :  :py:class:`~numpy.ndarray`
+            data is dataset
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        return self._file['statistics/' + name][:]
+
+    def get_run_stat_md(self, name):
+        '''Returns the meta-data dictionary of run level statistics
+
+        Parameters
+        ----------
+        name : :py:class:`str`
+            name of the data set, relative to `/statistics`
+
+        Returns
+        -------
+            md : :py:class:`dict`
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        return dict(self._file['statistics/' + name].attrs.iteritems())
+
     def get_frame_md(self, frame_num):
         '''Returns the meta-data dictionary for the given frame
 
@@ -329,7 +845,515 @@ class SM_serial(object):
         if not self._open:
             raise RuntimeError("Trying to operate on a closed file")
         grp = self._open_group(self._format_frame_name(frame_num, 'particles'))
-        return _subgroup_recurse(grp, '')
+        return _subgroup_recurse(grp, '', self._backend)
+
+    def list_frames(self):
+        '''Returns a sorted list of the frame numbers in the file
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        return sorted(int(k[5:]) for k in self._file.keys() if k.startswith('time_'))
+
+    def build_series(self, data_sets, frames=None, id_column=None,
+                     block_frames=None, chunk_particles=64, max_bytes=2 ** 28):
+        '''Builds a particle-major copy of the given data sets under
+        `/series` for fast access to the time series of individual
+        particles with :py:func:`loads_series`.
+
+        The copy is a snapshot, it is not updated by later calls to
+        :py:func:`dumps` and needs to be rebuilt after frames are
+        added or changed.  Existing series for `data_sets` are
+        replaced once all of the new ones are built, if building fails
+        they are left as they were.
+
+        Parameters
+        ----------
+        data_sets : :py:class:`list` of :py:class:`str`
+            names of the (1D) data sets to copy
+        frames : iterable of int or :py:class:`None`
+            frames to include, defaults to all frames in the file
+        id_column : :py:class:`str` or :py:class:`None`
+            name of a data set holding the particle (track) id of each
+            row.  If `None` the row number is the particle id and all
+            frames must have the same number of rows.  Particles
+            missing from a frame are filled with NaN (0 for non-float
+            data)
+        block_frames : int or :py:class:`None`
+            number of frames buffered in memory between writes, also the
+            time extent of the chunks.  Defaults to as many as fit in
+            `max_bytes`, at most 256
+        chunk_particles : int
+            particle extent of the chunks
+        max_bytes : int
+            memory budget of the buffered frames of all the data sets,
+            used when `block_frames` is `None`
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        if not self._write:
+            raise RuntimeError("trying to write to a read-only file")
+
+        if frames is None:
+            frames = self.list_frames()
+        frames = np.unique(np.asarray(frames, dtype=np.int64))
+        if len(frames) == 0:
+            raise ValueError("no frames to build the series from")
+
+        if id_column is None:
+            ids = np.arange(len(self.loads(frames[0], data_sets[0])))
+        else:
+            ids = np.unique(self.loads(frames[0], id_column))
+            for f in frames[1:]:
+                ids = np.union1d(ids, self.loads(f, id_column))
+        n_part, n_frames = len(ids), len(frames)
+        dtypes = [self.loads(frames[0], data_set).dtype for data_set in data_sets]
+        if block_frames is None:
+            per_frame = max(1, n_part * sum(dtype.itemsize for dtype in dtypes))
+            block_frames = int(min(256, max(1, max_bytes // per_frame)))
+
+        # build next to the existing series, they are only replaced at the end
+        if '_series_build' in self._file:
+            del self._file['_series_build']
+        try:
+            self._build_series(data_sets, dtypes, frames, ids, id_column,
+                               block_frames, chunk_particles)
+        except:
+            del self._file['_series_build']
+            raise
+        for data_set in data_sets:
+            path = 'series/' + data_set
+            if path in self._file:
+                del self._file[path]
+            self._require_grp(path.rsplit('/', 1)[0])
+            self._file.move('_series_build/' + data_set, path)
+        del self._file['_series_build']
+
+    def _build_series(self, data_sets, dtypes, frames, ids, id_column,
+                      block_frames, chunk_particles):
+        """Private function doing the work of :py:func:`build_series`,
+        the series are written under `/_series_build`.
+        """
+        n_part, n_frames = len(ids), len(frames)
+        dsets = []
+        for data_set, dtype in zip(data_sets, dtypes):
+            grp = self._require_grp('_series_build/' + data_set)
+            fill = np.nan if dtype.kind in 'fc' else 0
+            dset = grp.create_dataset('data', shape=(n_part, n_frames), dtype=dtype,
+                                      chunks=(max(1, min(n_part, chunk_particles)),
+                                              min(n_frames, block_frames)),
+                                      fillvalue=fill)
+            grp.create_dataset('frames', data=frames)
+            grp.create_dataset('particle_ids', data=ids)
+            grp.attrs['id_column'] = id_column if id_column is not None else ''
+            dsets.append((data_set, dset, fill))
+
+        for t0 in range(0, n_frames, block_frames):
+            block_frame_nums = frames[t0:t0 + block_frames]
+            blocks = [np.empty((n_part, len(block_frame_nums)), dtype=dset.dtype)
+                      for _, dset, _ in dsets]
+            for block, (_, _, fill) in zip(blocks, dsets):
+                block.fill(fill)
+            for j, f in enumerate(block_frame_nums):
+                if id_column is None:
+                    rows = slice(None)
+                else:
+                    rows = np.searchsorted(ids, self.loads(f, id_column))
+                for block, (data_set, _, _) in zip(blocks, dsets):
+                    values = self.loads(f, data_set)
+                    if values.ndim != 1 or (id_column is None and len(values) != n_part):
+                        raise ValueError("{0} in frame {1} does not have the shape ({2},)".format(
+                            data_set, f, n_part))
+                    block[rows, j] = values
+            for block, (_, dset, _) in zip(blocks, dsets):
+                dset[:, t0:t0 + len(block_frame_nums)] = block
+
+    def get_series_index(self, data_set):
+        '''Returns the particle ids and frames covered by the series of
+        a data set made by :py:func:`build_series`
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            name of the data set
+
+        Returns
+        -------
+        particle_ids : :py:class:`~numpy.ndarray`
+            sorted particle ids
+        frames : :py:class:`~numpy.ndarray`
+            sorted frame numbers
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        grp = self._open_group('series/' + data_set)
+        return grp['particle_ids'][:], grp['frames'][:]
+
+    def loads_series(self, particle_ids, data_set, frames=None, out=None):
+        '''Reads the time series of the given particles from the
+        particle-major copy made by :py:func:`build_series`.
+
+        Parameters
+        ----------
+        particle_ids : int or iterable of int
+            ids of the particles (the row numbers if the series was
+            built without an `id_column`)
+        data_set : :py:class:`str`
+            name of the data set
+        frames : iterable of int or :py:class:`None`
+            frames to return, defaults to all frames in the series
+        out : :py:class:`~numpy.ndarray` or :py:class:`None`
+            if given, the data is read into this (C contiguous) array,
+            see :py:func:`loads`.  Ascending, contiguous particles and
+            frames are read directly into it
+
+        Returns
+        -------
+        ret :  :py:class:`~numpy.ndarray`
+            array of shape (len(particle_ids), len(frames)), `out` if
+            given
+        '''
+
+        if not self._open:
+            raise RuntimeError("Trying to operate on a closed file")
+        grp = self._open_group('series/' + data_set)
+        dset = grp['data']
+        rows = _lookup(grp['particle_ids'][:], np.atleast_1d(particle_ids), 'particle id')
+        if frames is None:
+            cols = np.arange(dset.shape[1])
+        else:
+            cols = _lookup(grp['frames'][:], np.atleast_1d(frames), 'frame')
+        if out is not None:
+            _check_out(out, (len(rows), len(cols)), dset.dtype)
+            if _is_range(rows) and _is_range(cols):
+                self._backend.read_into(dset, out, np.s_[rows[0]:rows[-1] + 1,
+                                                         cols[0]:cols[-1] + 1])
+                return out
+        if len(rows) == 0 or len(cols) == 0:
+            if out is not None:
+                return out
+            return np.empty((len(rows), len(cols)), dtype=dset.dtype)
+
+        # only read the bounding box of the columns, and hand h5py a
+        # slice when the rows are contiguous
+        c0, c1 = cols.min(), cols.max() + 1
+        u_rows, inv = np.unique(rows, return_inverse=True)
+        if u_rows[-1] - u_rows[0] + 1 == len(u_rows):
+            block = dset[u_rows[0]:u_rows[-1] + 1, c0:c1]
+        else:
+            block = dset[u_rows.tolist(), c0:c1]
+        if out is None:
+            return block[inv][:, cols - c0]
+        out[...] = block[inv][:, cols - c0]
+        return out
+
+    def _dumps_stat(self, grp_path, name, data, meta_data, over_write, **kwargs):
+        """Private function to write a statistics data set `name` in the
+        group at `grp_path`, see :py:func:`dumps_run_stat`.
+        """
+        grp = self._require_grp(grp_path)
+        if name in grp:
+            if not over_write:
+                raise RuntimeError("trying to over-write existing statistics {0}".format(name))
+            del grp[name]
+        dset = grp.create_dataset(name, data=np.asarray(data), **kwargs)
+        if meta_data:
+            for key, value in meta_data.items():
+                dset.attrs[key] = value
+
+    def _create_dset(self, grp, frame_num, data_set, data, name=None, **kwargs):
+        """Private function to create a data set in `grp`, applying
+        any encoding set up for `data_set`.  The data set is named
+        `name` if given, `data_set` otherwise.
+
+        Returns
+        -------
+        dset : `~h5py._hl.dataset.Dataset`
+            the newly created data set
+        """
+        if data_set in self._summary_policy:
+            self._add_summary(frame_num, data_set, data)
+        attrs = {}
+        policy = self._delta_policy.get(data_set)
+        if policy is not None and data.dtype.kind == 'f':
+            data, attrs = self._delta_encode(frame_num, data_set, data, *policy)
+        policy = self._precision_policy.get(data_set)
+        if policy is not None and data.dtype.kind == 'f':
+            data, attrs = _narrow(data, *policy)
+        dset = grp.create_dataset(data_set if name is None else name, data=data, **kwargs)
+        for key, value in attrs.items():
+            dset.attrs[key] = value
+        return dset
+
+    def _delta_encode(self, frame_num, data_set, data, keyframe_interval, max_error):
+        """Private function to delta encode `data` against the most
+        recent keyframe of `data_set`.  If there is no usable keyframe
+        (too old, different shape, the deltas do not fit in 32 bits or
+        the error would exceed `max_error`) the data becomes the new
+        keyframe.
+
+        Returns
+        -------
+        data : :py:class:`~numpy.ndarray`
+            the array to store
+        attrs : :py:class:`dict`
+            the encoding attributes to store with it
+        """
+        cached = self._keyframes.get(data_set)
+        if cached is not None:
+            key_frame, key, key_interval = cached
+            # the interval stored with the keyframe bounds where over writing
+            # it looks for dependents, the policy may have changed since
+            if (key_frame < frame_num < key_frame + min(keyframe_interval, key_interval) and
+                    key.shape == data.shape and key.dtype == data.dtype):
+                step = 2 * max_error
+                q = _quantize_delta(data, key, step)
+                if q is not None:
+                    err = np.abs(_dequantize_delta(q, key, step) - data)
+                    err = err.max() if err.size else 0.
+                    if err <= max_error:
+                        return q, {'sm_encoding': 'delta',
+                                   'sm_keyframe': key_frame,
+                                   'sm_step': step,
+                                   'sm_error': err,
+                                   'sm_dtype': data.dtype.str}
+        # keep a private copy, the caller is free to modify `data`
+        self._keyframes[data_set] = (frame_num, data.copy(), keyframe_interval)
+        return data, {'sm_encoding': 'keyframe',
+                      'sm_keyframe_interval': keyframe_interval}
+
+    def _add_summary(self, frame_num, data_set, data):
+        """Private function to compute the summary statistics of `data`
+        and store them in the row for `frame_num` of the summary table
+        of `data_set`, creating the table if needed.  In a transaction
+        the row is stored when it commits.
+        """
+        edges = self._summary_policy[data_set]
+        row = _summarize(data, edges)
+        row['frame'] = frame_num
+        if self._txn is not None:
+            self._txn.summaries.append((data_set, row, edges))
+        else:
+            self._store_summary(data_set, row, edges)
+
+    def _store_summary(self, data_set, row, edges):
+        """Private function to store a row computed by
+        :py:func:`_add_summary`.
+        """
+        frame_num = int(row['frame'])
+        path = 'summary/' + data_set
+        if path not in self._file:
+            table = self._require_grp('summary').create_dataset(
+                data_set, shape=(0,), maxshape=(None,), dtype=row.dtype, chunks=(1024,))
+            if edges is not None:
+                table.attrs['bin_edges'] = edges
+            self._summary_rows[data_set] = {}
+        table = self._file[path]
+        if data_set not in self._summary_rows:
+            self._summary_rows[data_set] = dict((f, j) for j, f in enumerate(table['frame']))
+        rows = self._summary_rows[data_set]
+
+        j = rows.get(frame_num)
+        if j is None:
+            j = rows[frame_num] = table.shape[0]
+            table.resize((j + 1,))
+        table[j] = row
+
+    def _decode(self, data_set, dset, out=None):
+        """Private function to read a data set and undo any encoding
+        applied by :py:func:`dumps`.
+
+        Parameters
+        ----------
+        data_set : :py:class:`str`
+            name of the data set
+        dset : `~h5py._hl.dataset.Dataset`
+            the stored data set
+        out : :py:class:`~numpy.ndarray` or :py:class:`None`
+            array to decode into, see :py:func:`loads`
+
+        Returns
+        -------
+        ret :  :py:class:`~numpy.ndarray`
+            the decoded data
+        """
+        attrs = dset.attrs
+        encoding = attrs.get('sm_encoding')
+        if encoding in ('delta', 'fixed', 'float32'):
+            dtype = np.dtype(attrs['sm_dtype'])
+        else:
+            dtype = dset.dtype
+        if out is not None:
+            _check_out(out, dset.shape, dtype)
+
+        if encoding == 'delta':
+            key = self._load_keyframe(data_set, int(attrs['sm_keyframe']))
+            return _dequantize_delta(dset[:], key, attrs['sm_step'], out)
+        if encoding == 'fixed':
+            return _unfix(dset[:], attrs['sm_scale'], attrs['sm_offset'], dtype, out)
+        if encoding == 'float32':
+            if out is None:
+                return dset[:].astype(dtype)
+            out[...] = dset[:]
+            return out
+        if out is None:
+            return dset[:]
+        self._backend.read_into(dset, out)
+        return out
+
+    def _load_keyframe(self, data_set, key_frame):
+        """Private function to get a keyframe, from the cache of the
+        most recently used keyframe of each data set if possible.
+        """
+        cached = self._keyframes.get(data_set)
+        if cached is not None and cached[0] == key_frame:
+            return cached[1]
+        dset = self._file[self._format_frame_name(key_frame, 'particles')][data_set]
+        key = dset[:]
+        self._keyframes[data_set] = (key_frame, key, int(dset.attrs['sm_keyframe_interval']))
+        return key
+
+    def _check_keyframe_dependents(self, frame_num, data_set, dset):
+        """Private function which raises if `dset` is a keyframe which
+        delta encoded frames depend on.
+        """
+        if dset.attrs.get('sm_encoding') != 'keyframe':
+            return
+        for k in range(frame_num + 1, frame_num + int(dset.attrs['sm_keyframe_interval'])):
+            path = self._format_frame_name(k, 'particles') + '/' + data_set
+            if self._txn is not None and path in self._txn.staged:
+                # staged in this transaction, replaces what is in the file
+                path = self._txn.staged[path]
+            elif path not in self._file:
+                continue
+            attrs = self._file[path].attrs
+            if attrs.get('sm_encoding') == 'delta' and attrs['sm_keyframe'] == frame_num:
+                # TODO use custom class for this exception
+                raise RuntimeError("frame {0} of {1} is delta encoded against this keyframe, "
+                                   "can not over write it".format(k, data_set))
+
+    def _stage_dumps(self, frame_num, data_set, data, meta_data, over_write, **kwargs):
+        """Private function doing the work of :py:func:`dumps` in a
+        transaction.  The data set is created in the journal and moved
+        into place by the commit.
+        """
+        txn = self._txn
+        path = self._format_frame_name(frame_num, 'particles') + '/' + data_set
+        if path in txn.staged:
+            dset = self._file[txn.staged[path]]
+        elif path in self._file:
+            dset = self._file[path]
+            if over_write and not self._backend.is_dataset(dset):
+                # TODO use custom class for this exception
+                raise RuntimeError("there is a group (not a dataset) where the data set needs to go."
+                                   "Check names and that file is valid")
+        else:
+            dset = None
+        if dset is not None and not over_write:
+            if meta_data:
+                self._stage_md(path, dset, meta_data, True)
+            return
+        if dset is not None:
+            self._check_keyframe_dependents(frame_num, data_set, dset)
+            cached = self._keyframes.get(data_set)
+            if cached is not None and cached[0] == frame_num:
+                del self._keyframes[data_set]
+
+        name = txn.next_name()
+        dset = self._create_dset(self._file[txn.path], frame_num, data_set, data, name=name, **kwargs)
+        if meta_data:
+            for key, value in meta_data.items():
+                dset.attrs[key] = value
+        src = txn.path + '/' + name
+        txn.ops.append(['move', src, path])
+        txn.staged[path] = src
+        txn.md_keys.pop(path, None)
+        txn.keys.add((frame_num, data_set))
+
+    def _stage_md(self, path, obj, meta_data, over_write):
+        """Private function to stage setting `meta_data` on the object
+        at `path`, `obj` is its current state (`None` if it does not
+        exist yet) to check `over_write` against.  The meta-data is
+        kept on an empty group in the journal.
+        """
+        txn = self._txn
+        staged_keys = txn.md_keys.setdefault(path, set())
+        if not over_write:
+            existing_keys = set(obj.attrs.keys()) if obj is not None else set()
+            if any(k in existing_keys or k in staged_keys for k in meta_data.keys()):
+                raise RuntimeError("trying to over-write an existing key")
+        name = txn.next_name()
+        grp = self._require_grp(txn.path + '/' + name)
+        for key, value in meta_data.items():
+            grp.attrs[key] = value
+        staged_keys.update(meta_data.keys())
+        txn.ops.append(['attrs', txn.path + '/' + name, path])
+
+    def _commit(self, txn):
+        """Private function to commit a transaction.  The list of
+        operations is written and flushed before any of them is
+        applied, so :py:func:`_recover` can finish the commit.
+        """
+        grp = self._file[txn.path]
+        ops = np.frombuffer(json.dumps(txn.ops).encode('utf-8'), dtype=np.uint8)
+        grp.create_dataset('ops', data=ops)
+        grp.attrs['done'] = 0
+        grp.attrs['state'] = 'committing'
+        self._file.flush()
+
+        self._apply_journal(txn.path)
+        for data_set, row, edges in txn.summaries:
+            self._store_summary(data_set, row, edges)
+        if self._cache is not None:
+            for frame_num, data_set in txn.keys:
+                self._cache.invalidate((self._cache_name, frame_num, data_set))
+        del self._file[txn.path]
+        self._drop_journal()
+        self._file.flush()
+
+    def _apply_journal(self, path):
+        """Private function to apply the operations of the committing
+        transaction at `path`, starting after the last one done.
+        """
+        grp = self._file[path]
+        ops = json.loads(grp['ops'][:].tostring().decode('utf-8'))
+        for j in range(int(grp.attrs['done']), len(ops)):
+            kind, src, dst = ops[j]
+            if kind == 'move':
+                if src not in self._file:
+                    # moved before the process died, `done` was not updated
+                    continue
+                if dst in self._file:
+                    del self._file[dst]
+                self._require_grp(dst.rsplit('/', 1)[0])
+                self._file.move(src, dst)
+            else:
+                obj = self._file[dst] if dst in self._file else self._require_grp(dst)
+                for key, value in self._file[src].attrs.items():
+                    obj.attrs[key] = value
+            grp.attrs['done'] = j + 1
+
+    def _recover(self):
+        """Private function to clean up after transactions which did
+        not finish: the commits which started are finished, the rest
+        are dropped.
+        """
+        journal = self._file['_journal']
+        for name in journal.keys():
+            path = '_journal/' + name
+            if journal[name].attrs.get('state') == 'committing':
+                self._apply_journal(path)
+            del self._file[path]
+        self._drop_journal()
+        self._file.flush()
+
+    def _drop_journal(self):
+        """Private function to remove `/_journal` once it is empty
+        """
+        if '_journal' in self._file and not len(self._file['_journal'].keys()):
+            del self._file['_journal']
 
     def _require_grp(self, path):
         """Private function to handle requiring that a group exists.
@@ -387,11 +1411,142 @@ class SM_serial(object):
                    "File: {0}".format(self._file.filename))
             raise e
 
-        if not isinstance(grp, h5py._hl.group.Group):
+        if not self._backend.is_group(grp):
             raise RuntimeError("The object found is not a group")
         return grp
 
 
+class ArrayCache(object):
+    '''
+    A least recently used cache of decoded arrays for
+    :py:func:`SM_serial.loads`, limited by the total size of the
+    arrays rather than their number.
+
+    The cached arrays are read-only, every hit returns a new view of
+    them.  Safe to use from several threads.
+
+    Parameters
+    ----------
+    max_bytes : int
+        the most bytes of array data to keep, larger arrays are not
+        cached
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0       #: bytes of array data in the cache
+        self.hits = 0         #: number of lookups found in the cache
+        self.misses = 0       #: number of lookups not found
+        self.evictions = 0    #: number of arrays dropped to stay in budget
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        '''Returns a read-only view of the array cached for `key`, or
+        `None`
+        '''
+        with self._lock:
+            try:
+                arr = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = arr
+            self.hits += 1
+        return arr.view()
+
+    def put(self, key, arr):
+        '''Caches `arr` for `key`, making it read-only.  The caller
+        must not change `arr` afterwards.
+        '''
+        if arr.nbytes > self.max_bytes:
+            return
+        arr.setflags(write=False)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._data[key] = arr
+            self.nbytes += arr.nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self._data.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+
+    def invalidate(self, key):
+        '''Drops the entry for `key`, if there is one
+        '''
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+
+    def clear(self):
+        '''Drops all entries, the counters are kept
+        '''
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+
+def peek(fname, attrs=None, backend=None):
+    '''Reads the version, the number of frames and root attributes of
+    a file, doing as little work as possible.  Meant for short lived
+    tools, the file is only opened read-only and `numpy` is not
+    imported for the 'npy' backend.
+
+    Parameters
+    ----------
+    fname : :py:class:`str`
+        full path to the file
+    attrs : :py:class:`list` of :py:class:`str` or :py:class:`None`
+        the root attributes to read, all if `None`.  Those not in the
+        file are left out
+    backend : :py:class:`str` or :py:class:`None`
+        see :py:func:`SM_serial.open`, defaults to 'npy' if `fname` is
+        a directory and 'hdf5' otherwise
+
+    Returns
+    -------
+    info : :py:class:`dict`
+        'version' (`None` if not set), 'n_frames' and 'attrs'
+    '''
+    if backend is None:
+        backend = 'npy' if os.path.isdir(fname) else 'hdf5'
+    if backend not in SM_serial._VALID_BACKENDS:
+        raise ValueError("invalid backend {0}".format(backend))
+    want = None if attrs is None else list(attrs) + ['version']
+    md, names = backends.get_backend(backend).peek(fname, want)
+    version = md.get('version')
+    if attrs is not None and 'version' not in attrs:
+        md.pop('version', None)
+    # frame names sort together, and after the digits comes ':'
+    names = sorted(names)
+    n_frames = bisect.bisect_left(names, 'time_:') - bisect.bisect_left(names, 'time_')
+    return {'version': version, 'n_frames': n_frames, 'attrs': md}
+
+
+class _Transaction(object):
+    """Private class holding the state of a transaction, see
+    :py:func:`SM_serial.transaction`
+    """
+    def __init__(self, path):
+        self.path = path      # journal group the writes are staged in
+        self.ops = []         # [kind, source, destination] in the order to apply them
+        self.staged = {}      # destination path -> staged data set
+        self.md_keys = {}     # destination path -> meta-data keys staged for it
+        self.summaries = []   # (data_set, row, edges) to store at commit
+        self.keys = set()     # (frame_num, data_set) to drop from the cache
+        self._count = 0
+
+    def next_name(self):
+        name = str(self._count)
+        self._count += 1
+        return name
+
+
 def _object_set_md(obj, meta_data, over_write):
     """Private function for setting meta-data
 
@@ -414,7 +1569,177 @@ def _object_set_md(obj, meta_data, over_write):
         obj.attrs[key] = value
 
 
-def _subgroup_recurse(base_object, base_path):
+def _quantize_delta(data, key, step):
+    """Private function to quantize the difference between `data`
+    and `key` to integer multiples of `step`.
+
+    Returns
+    -------
+    q : :py:class:`~numpy.ndarray` or `None`
+        the quantized deltas in the smallest signed integer type that
+        holds them, `None` if they can not be represented in 32 bits
+    """
+    q = np.rint((data - key) / step)
+    if not np.all(np.isfinite(q)):
+        return None
+    max_q = np.abs(q).max() if q.size else 0
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_q <= np.iinfo(dtype).max:
+            return q.astype(dtype)
+    return None
+
+
+def _dequantize_delta(q, key, step, out=None):
+    """Private function to invert :py:func:`_quantize_delta`, into
+    `out` if given
+    """
+    if out is None:
+        return (key + q * step).astype(key.dtype)
+    np.multiply(q, step, out=out)
+    out += key
+    return out
+
+
+def _narrow(data, mode, max_error, offset):
+    """Private function to apply a storage precision (see
+    :py:func:`SM_serial.set_storage_precision`) to floating point data.
+
+    Returns
+    -------
+    data : :py:class:`~numpy.ndarray`
+        the array to store
+    attrs : :py:class:`dict`
+        the encoding attributes to store with it
+    """
+    if mode == 'float32':
+        if data.dtype.itemsize <= 4:
+            return data, {}
+        narrow = data.astype(np.float32)
+        if np.any(np.isinf(narrow) & np.isfinite(data)):
+            # out of the float32 range, keep the frame as is
+            return data, {}
+        err = np.abs(narrow - data)
+        return narrow, {'sm_encoding': 'float32',
+                        'sm_error': np.nanmax(err) if err.size else 0.,
+                        'sm_dtype': data.dtype.str}
+
+    if not np.all(np.isfinite(data)):
+        return data, {}
+    scale = 2 * max_error
+    if offset is None:
+        offset = data.min() if data.size else 0.
+    q = np.rint((data - offset) / scale)
+    if q.size and q.min() < 0:
+        raise ValueError("data below the offset {0} of the fixed point encoding".format(offset))
+    max_q = q.max() if q.size else 0
+    if max_q > 2 ** 53:
+        # the quantized values are no longer exact in float64, or do
+        # not fit in a uint64, keep the frame as is
+        return data, {}
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if max_q <= np.iinfo(dtype).max:
+            break
+    q = q.astype(dtype)
+    err = np.abs(_unfix(q, scale, offset, data.dtype) - data)
+    err = err.max() if err.size else 0.
+    if err > max_error:
+        return data, {}
+    return q, {'sm_encoding': 'fixed',
+               'sm_scale': scale,
+               'sm_offset': offset,
+               'sm_error': err,
+               'sm_dtype': data.dtype.str}
+
+
+def _unfix(q, scale, offset, dtype, out=None):
+    """Private function to decode fixed point data, into `out` if
+    given
+    """
+    if out is None:
+        out = np.empty(q.shape, dtype=dtype)
+    np.multiply(q, scale, out=out)
+    out += offset
+    return out
+
+
+def _check_out(out, shape, dtype):
+    """Private function to check that `out` can take data of the
+    given shape and dtype, raises `ValueError` if not.
+    """
+    if not isinstance(out, np.ndarray):
+        raise ValueError("out must be a numpy array")
+    if out.shape != tuple(shape):
+        raise ValueError("out has shape {0}, need {1}".format(out.shape, tuple(shape)))
+    if out.dtype != dtype:
+        raise ValueError("out has dtype {0}, need {1}".format(out.dtype, dtype))
+    if not (out.flags.c_contiguous and out.flags.writeable):
+        raise ValueError("out must be C contiguous and writeable")
+
+
+def _is_range(idx):
+    """Private function returning if the integer array `idx` is an
+    ascending run of consecutive values
+    """
+    return len(idx) > 0 and idx[-1] - idx[0] + 1 == len(idx) and np.all(np.diff(idx) == 1)
+
+
+def _summarize(data, edges):
+    """Private function to compute the summary statistics of the
+    finite values of `data`.
+
+    Parameters
+    ----------
+    data : :py:class:`~numpy.ndarray`
+        the data, must be bool, int, uint or float
+    edges : :py:class:`~numpy.ndarray` or `None`
+        histogram bin edges, `None` for no histogram
+
+    Returns
+    -------
+    row : :py:class:`~numpy.ndarray`
+        0d record array with the fields 'frame' (not filled in),
+        'count', 'min', 'max', 'mean', 'var' and, if `edges` is not
+        `None`, 'hist'
+    """
+    if data.dtype.kind not in 'biuf':
+        raise ValueError("can only summarize real data, not {0}".format(data.dtype))
+    fields = [('frame', np.int64), ('count', np.int64), ('min', np.float64),
+              ('max', np.float64), ('mean', np.float64), ('var', np.float64)]
+    if edges is not None:
+        fields.append(('hist', np.int64, (len(edges) - 1,)))
+    row = np.zeros((), dtype=fields)
+
+    flat = data.ravel()
+    if data.dtype.kind == 'f':
+        flat = flat[np.isfinite(flat)]
+    row['count'] = flat.size
+    if flat.size:
+        flat = flat.astype(np.float64)
+        row['min'] = flat.min()
+        row['max'] = flat.max()
+        row['mean'] = flat.mean()
+        row['var'] = flat.var()
+    else:
+        for key in ('min', 'max', 'mean', 'var'):
+            row[key] = np.nan
+    if edges is not None:
+        row['hist'] = np.histogram(flat, edges)[0]
+    return row
+
+
+def _lookup(keys, wanted, what):
+    """Private function to find the positions of `wanted` in the
+    sorted array `keys`, raising `KeyError` if any are missing.
+    """
+    idx = np.searchsorted(keys, wanted)
+    found = idx < len(keys)
+    found[found] = keys[idx[found]] == wanted[found]
+    if not np.all(found):
+        raise KeyError("{0} {1} not found".format(what, wanted[~found][0]))
+    return idx
+
+
+def _subgroup_recurse(base_object, base_path, backend):
     """
     Private function for finding all the data sets under a given group.
 
@@ -425,6 +1750,8 @@ def _subgroup_recurse(base_object, base_path):
         The object to look for data sets in
     base_path : :py:class:`str`
         Relative path of the base object relative to where the search started
+    backend : `~sm_core.backends.Backend`
+        The backend the object comes from
 
     Returns
     -------
@@ -434,8 +1761,8 @@ def _subgroup_recurse(base_object, base_path):
     name_list = []
     for key in base_object.keys():
         obj = base_object[key]
-        if isinstance(obj, h5py._hl.dataset.Dataset):
+        if backend.is_dataset(obj):
             name_list.append(base_path + '/' + key)
-        elif isinstance(obj, h5py._hl.group.Group):
-            name_list.extend(_subgroup_recurse(obj, base_path + '/' + key))
+        elif backend.is_group(obj):
+            name_list.extend(_subgroup_recurse(obj, base_path + '/' + key, backend))
     return name_list
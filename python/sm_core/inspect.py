@@ -0,0 +1,368 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import os
+import sys
+import json
+import argparse
+import collections
+import h5py
+import numpy as np
+
+'''
+Inspect the layout of an SM file and suggest storage settings::
+
+    python -m sm_core.inspect file.h5 [--json] [--sample N]
+
+Only the metadata of the file is read (sizes, chunking, filters and
+attribute counts), never the data, and for runs with more than
+`--sample` frames only an evenly spaced subset of the frames is walked
+and the totals are scaled up, so even multi-GB files take seconds.
+'''
+
+_KiB = 1024
+_MiB = 1024 * 1024
+_TARGET_CHUNK = _MiB   #: chunk size recommended for large data sets
+
+
+def inspect_file(fname, sample=2000):
+    '''Collects the layout statistics of an hdf5 SM file.
+
+    Parameters
+    ----------
+    fname : :py:class:`str`
+        path of the file
+    sample : int
+        the most frames to walk, the totals of the columns are scaled
+        up from this many evenly spaced frames
+
+    Returns
+    -------
+    report : :py:class:`dict`
+        the statistics, see :py:func:`format_report`
+    '''
+    with h5py.File(fname, 'r') as f:
+        frame_names = sorted(k for k in f.keys() if k.startswith('time_'))
+        if len(frame_names) > sample:
+            pick = np.unique(np.linspace(0, len(frame_names) - 1, sample).astype(int))
+            walked = [frame_names[j] for j in pick]
+        else:
+            walked = frame_names
+        scale = len(frame_names) / float(max(len(walked), 1))
+
+        columns = collections.OrderedDict()
+        other = collections.OrderedDict()
+        # frame and other objects are counted apart, only the frames are sampled
+        counts = {'objects': 0, 'attrs': 0}
+        other_counts = {'objects': 0, 'attrs': len(f.attrs)}
+
+        def frame_visitor(name, obj):
+            counts['objects'] += 1
+            counts['attrs'] += len(obj.attrs)
+            if isinstance(obj, h5py.Dataset):
+                _add_dset(columns.setdefault(name, _new_entry()), obj)
+
+        def other_visitor(prefix):
+            def visitor(name, obj):
+                other_counts['objects'] += 1
+                other_counts['attrs'] += len(obj.attrs)
+                if isinstance(obj, h5py.Dataset):
+                    _add_dset(other.setdefault(prefix + '/' + name, _new_entry()), obj)
+            return visitor
+
+        for frame_name in walked:
+            counts['objects'] += 1
+            counts['attrs'] += len(f[frame_name].attrs)
+            f[frame_name].visititems(frame_visitor)
+        for key in f.keys():
+            if not key.startswith('time_'):
+                other_counts['objects'] += 1
+                obj = f[key]
+                other_counts['attrs'] += len(obj.attrs)
+                if isinstance(obj, h5py.Group):
+                    obj.visititems(other_visitor(key))
+                else:
+                    _add_dset(other.setdefault(key, _new_entry()), obj)
+
+        for entry in columns.values():
+            entry['frames'] = int(round(entry['count'] * scale))
+            for key in ('storage_bytes', 'raw_bytes', 'logical_bytes', 'attrs'):
+                entry[key] = int(round(entry[key] * scale))
+        for entry in columns.values() + other.values():
+            _finish_entry(entry)
+
+        data_storage = sum(e['storage_bytes'] for e in columns.values() + other.values())
+        file_size = os.path.getsize(fname)
+        report = {'file': fname,
+                  'file_size': file_size,
+                  'version': _attr_str(f.attrs.get('version')),
+                  'writer': _attr_str(f.attrs.get('writer')),
+                  'n_frames': len(frame_names),
+                  'first_frame': int(frame_names[0][5:]) if frame_names else None,
+                  'last_frame': int(frame_names[-1][5:]) if frame_names else None,
+                  'sampled_frames': len(walked),
+                  'estimated': len(walked) < len(frame_names),
+                  'n_objects': int(round(counts['objects'] * scale)) + other_counts['objects'],
+                  'n_attrs': int(round(counts['attrs'] * scale)) + other_counts['attrs'],
+                  'data_storage': data_storage,
+                  'free_space': f.id.get_freespace(),
+                  'overhead': file_size - data_storage,
+                  'columns': columns,
+                  'other': other}
+    report['recommendations'] = recommend(report)
+    return report
+
+
+def _new_entry():
+    """Private function returning the empty statistics of a column
+    """
+    return {'count': 0, 'storage_bytes': 0, 'raw_bytes': 0, 'logical_bytes': 0,
+            'min_frame_bytes': None, 'max_frame_bytes': 0, 'attrs': 0,
+            'dtypes': collections.Counter(), 'logical_dtypes': collections.Counter(),
+            'chunks': collections.Counter(), 'filters': collections.Counter(),
+            'encodings': collections.Counter(), 'shape': None}
+
+
+def _add_dset(entry, dset):
+    """Private function to add the metadata of one data set to the
+    statistics of its column
+    """
+    storage = dset.id.get_storage_size()
+    n = int(np.prod(dset.shape)) if dset.shape else 1
+    attrs = dset.attrs
+    encoding = _attr_str(attrs.get('sm_encoding')) if 'sm_encoding' in attrs else None
+    logical = np.dtype(_attr_str(attrs['sm_dtype'])) if 'sm_dtype' in attrs else dset.dtype
+
+    entry['count'] += 1
+    entry['storage_bytes'] += storage
+    entry['raw_bytes'] += n * dset.dtype.itemsize
+    entry['logical_bytes'] += n * logical.itemsize
+    entry['min_frame_bytes'] = storage if entry['min_frame_bytes'] is None else min(entry['min_frame_bytes'], storage)
+    entry['max_frame_bytes'] = max(entry['max_frame_bytes'], storage)
+    entry['attrs'] += len(attrs)
+    entry['dtypes'][dset.dtype.str] += 1
+    entry['logical_dtypes'][logical.str] += 1
+    entry['chunks'][str(dset.chunks) if dset.chunks else 'contiguous'] += 1
+    entry['filters'][_filters(dset)] += 1
+    entry['encodings'][encoding or 'none'] += 1
+    entry['shape'] = dset.shape
+
+
+def _filters(dset):
+    """Private function describing the filters of a data set
+    """
+    filters = []
+    if dset.scaleoffset is not None:
+        filters.append('scaleoffset={0}'.format(dset.scaleoffset))
+    if dset.shuffle:
+        filters.append('shuffle')
+    if dset.compression:
+        if dset.compression_opts is not None:
+            filters.append('{0}={1}'.format(dset.compression, dset.compression_opts))
+        else:
+            filters.append(dset.compression)
+    if dset.fletcher32:
+        filters.append('fletcher32')
+    return ','.join(filters) or 'none'
+
+
+def _finish_entry(entry):
+    """Private function to turn the counters of a column into plain
+    values
+    """
+    entry['frames'] = entry.get('frames', entry['count'])
+    entry['mean_frame_bytes'] = entry['storage_bytes'] / float(max(entry['frames'], 1))
+    entry['compression_ratio'] = (entry['raw_bytes'] / float(entry['storage_bytes'])
+                                  if entry['storage_bytes'] else None)
+    entry['encoded_ratio'] = (entry['logical_bytes'] / float(entry['storage_bytes'])
+                              if entry['storage_bytes'] else None)
+    for key in ('dtypes', 'logical_dtypes', 'chunks', 'filters', 'encodings'):
+        entry[key] = dict(entry[key])
+    entry['shape'] = list(entry['shape']) if entry['shape'] is not None else None
+
+
+def _attr_str(value):
+    """Private function to turn a string attribute into a str
+    """
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _most_common(counter):
+    """Private function returning the most common key of a dict of counts
+    """
+    return max(counter.items(), key=lambda kv: kv[1])[0] if counter else None
+
+
+def recommend(report):
+    '''Suggests storage settings based on the statistics from
+    :py:func:`inspect_file`.
+
+    Returns
+    -------
+    advice : :py:class:`list` of :py:class:`str`
+    '''
+    advice = []
+    file_size = max(report['file_size'], 1)
+    n_frames = report['n_frames']
+
+    if report['free_space'] > 0.1 * file_size:
+        advice.append("{0} of the file is free space left by deleted or over written data, "
+                      "run h5repack to reclaim it".format(_fmt_bytes(report['free_space'])))
+    if n_frames and report['overhead'] > 0.25 * file_size and report['overhead'] > _MiB:
+        advice.append("{0:.0f}% of the file ({1} object headers, {2} attributes) is metadata, "
+                      "fewer and larger data sets per frame (or the 'npy' backend) would "
+                      "cut it".format(100. * report['overhead'] / file_size,
+                                      report['n_objects'], report['n_attrs']))
+
+    for name, entry in report['columns'].items() + report['other'].items():
+        if not entry['storage_bytes']:
+            continue
+        dtype = np.dtype(str(_most_common(entry['dtypes'])))
+        filters = _most_common(entry['filters'])
+        chunks = _most_common(entry['chunks'])
+        per_frame = entry['mean_frame_bytes']
+        big = entry['storage_bytes'] > 10 * _MiB
+
+        if big and filters == 'none' and dtype.kind in 'iuf' and per_frame > 4 * _KiB:
+            advice.append("{0}: {1} uncompressed, try compression='gzip', compression_opts=4, "
+                          "shuffle=True{2}".format(
+                              name, _fmt_bytes(entry['storage_bytes']),
+                              " or a storage precision / delta encoding for float data"
+                              if dtype.kind == 'f' and dtype.itemsize == 8 else ""))
+        if filters not in ('none', None) and entry['compression_ratio'] is not None \
+                and entry['compression_ratio'] < 1.1:
+            advice.append("{0}: compression only saves {1:.0f}%, drop the filters ({2}) "
+                          "to save cpu time".format(
+                              name, 100 * (1 - 1 / entry['compression_ratio']), filters))
+        if chunks != 'contiguous' and chunks is not None and entry['shape']:
+            chunk_shape = [int(c) for c in chunks.strip('()').split(',') if c.strip()]
+            chunk_bytes = int(np.prod(chunk_shape)) * dtype.itemsize
+            data_bytes = int(np.prod(entry['shape'])) * dtype.itemsize
+            if chunk_bytes < 16 * _KiB and data_bytes > 4 * chunk_bytes:
+                advice.append("{0}: chunks of {1} are small, use chunks of about {2}".format(
+                    name, _fmt_bytes(chunk_bytes), _suggest_chunks(entry['shape'], dtype)))
+            elif chunk_bytes > 4 * _MiB:
+                advice.append("{0}: chunks of {1} are large (every partial read decompresses "
+                              "a whole chunk), use chunks of about {2}".format(
+                                  name, _fmt_bytes(chunk_bytes),
+                                  _suggest_chunks(entry['shape'], dtype)))
+        if name in report['columns'] and n_frames > 1000 and per_frame < 4 * _KiB:
+            advice.append("{0}: {1} per frame is small, the per-object overhead of hdf5 "
+                          "dominates".format(name, _fmt_bytes(per_frame)))
+    return advice
+
+
+def _suggest_chunks(shape, dtype):
+    """Private function suggesting a chunk shape of about 1 MiB
+    """
+    rest = int(np.prod(shape[1:])) * dtype.itemsize if len(shape) > 1 else dtype.itemsize
+    first = max(1, min(shape[0], _TARGET_CHUNK // max(rest, 1)))
+    return str(tuple([first] + list(shape[1:])))
+
+
+def _fmt_bytes(n):
+    """Private function to format a byte count
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(n) < 1024 or unit == 'GiB':
+            return '{0:.1f} {1}'.format(n, unit) if unit != 'B' else '{0:d} B'.format(int(n))
+        n /= 1024.
+
+
+def format_report(report):
+    '''Formats the statistics from :py:func:`inspect_file` as text
+    '''
+    lines = []
+    lines.append('file          {0}'.format(report['file']))
+    lines.append('size          {0}'.format(_fmt_bytes(report['file_size'])))
+    lines.append('version       {0} ({1})'.format(report['version'], report['writer']))
+    frames = '{0}'.format(report['n_frames'])
+    if report['n_frames']:
+        frames += ' ({0} - {1})'.format(report['first_frame'], report['last_frame'])
+    if report['estimated']:
+        frames += ', {0} sampled, totals are estimates'.format(report['sampled_frames'])
+    lines.append('frames        {0}'.format(frames))
+    lines.append('objects       {0} with {1} attributes'.format(report['n_objects'], report['n_attrs']))
+    lines.append('data          {0}'.format(_fmt_bytes(report['data_storage'])))
+    lines.append('metadata/free {0} ({1} tracked free space)'.format(
+        _fmt_bytes(report['overhead']), _fmt_bytes(report['free_space'])))
+
+    header = '{0:30s} {1:>7s} {2:>11s} {3:>11s} {4:>6s} {5:>8s} {6:>10s} {7:20s} {8}'.format(
+        'data set', 'frames', 'total', 'per frame', 'ratio', 'dtype', 'encoding', 'chunks', 'filters')
+    for title, entries in (('per frame data sets', report['columns']),
+                           ('other data sets', report['other'])):
+        if not entries:
+            continue
+        lines.append('')
+        lines.append(title)
+        lines.append(header)
+        for name, entry in entries.items():
+            ratio = entry['encoded_ratio']
+            lines.append('{0:30s} {1:7d} {2:>11s} {3:>11s} {4:>6s} {5:>8s} {6:>10s} {7:20s} {8}'.format(
+                name, entry['frames'], _fmt_bytes(entry['storage_bytes']),
+                _fmt_bytes(entry['mean_frame_bytes']),
+                '{0:.2f}'.format(ratio) if ratio is not None else '-',
+                _most_common(entry['dtypes']), _most_common(entry['encodings']),
+                _most_common(entry['chunks']), _most_common(entry['filters'])))
+
+    lines.append('')
+    lines.append('recommendations')
+    for advice in report['recommendations'] or ['none']:
+        lines.append(' - ' + advice)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    '''Command line entry point
+    '''
+    parser = argparse.ArgumentParser(prog='python -m sm_core.inspect',
+                                     description='Report the layout of an SM hdf5 file '
+                                                 'and suggest storage settings')
+    parser.add_argument('fname', help='the file to inspect')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--sample', type=int, default=2000,
+                        help='the most frames to walk (default 2000)')
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.fname):
+        parser.error('{0} is not an hdf5 file'.format(args.fname))
+
+    report = inspect_file(args.fname, sample=args.sample)
+    if args.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print format_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import time
+import numpy as np
+
+'''
+Mean squared displacement and velocity autocorrelation of tracked
+particles.
+
+Both are computed with the FFT based O(T log(T)) algorithm, vectorized
+over particles.  The positions are read, a block of particles at a
+time, from the particle-major copy of the position columns (see
+:py:func:`~sm_core.data_serialization.SM_serial.build_series`), so
+memory use is bounded independent of the number of particles.
+Particles missing from frames (NaN in the series) are handled by only
+counting the pairs of frames where the particle is present.
+'''
+
+
+def compute_msd(sms, columns=('x', 'y'), frames=None, max_lag=None,
+                block_particles=None, max_bytes=2 ** 28):
+    '''Computes the ensemble averaged mean squared displacement and
+    velocity autocorrelation.
+
+    Parameters
+    ----------
+    sms : `~sm_core.data_serialization.SM_serial`
+        file to read from, :py:func:`build_series` must have been run
+        for `columns`
+    columns : :py:class:`list` of :py:class:`str`
+        names of the position data sets
+    frames : iterable of int or :py:class:`None`
+        frames to use, must be evenly spaced.  Defaults to all frames
+        in the series
+    max_lag : int or :py:class:`None`
+        largest lag (in frames) to return, defaults to all lags
+    block_particles : int or :py:class:`None`
+        number of particles processed at once, defaults to as many as
+        fit in `max_bytes`
+    max_bytes : int
+        rough memory budget used to pick `block_particles`
+
+    Returns
+    -------
+    res : :py:class:`dict`
+        'lag' (in frames), 'msd' and 'count' (the number of
+        displacements averaged for each lag), 'vacf' and 'vacf_count'
+        (the velocity autocorrelation in units of position^2/frame^2
+        and its counts, at most T - 1 lags), and 'frames'
+    '''
+    ids, all_frames = sms.get_series_index(columns[0])
+    for col in columns[1:]:
+        other_ids, other_frames = sms.get_series_index(col)
+        if not (np.array_equal(ids, other_ids) and np.array_equal(all_frames, other_frames)):
+            raise ValueError("the series of {0} and {1} do not match".format(columns[0], col))
+    frames = all_frames if frames is None else np.unique(np.asarray(frames))
+    if len(frames) < 2:
+        raise ValueError("need at least 2 frames")
+    if len(np.unique(np.diff(frames))) != 1:
+        raise ValueError("frames must be evenly spaced")
+
+    T = len(frames)
+    n_fft = _fft_size(2 * T)
+    if block_particles is None:
+        # the positions, the mask, their transforms and some temporaries
+        per_particle = n_fft * 16 * (2 * len(columns) + 4)
+        block_particles = max(1, int(max_bytes // per_particle))
+
+    msd_acc = np.zeros(n_fft // 2 + 1)
+    count_acc = np.zeros(n_fft // 2 + 1)
+    vacf_acc = np.zeros(n_fft // 2 + 1)
+    vacf_count_acc = np.zeros(n_fft // 2 + 1)
+    for j in range(0, len(ids), block_particles):
+        block_ids = ids[j:j + block_particles]
+        pos = np.array([sms.loads_series(block_ids, col, frames=frames) for col in columns])
+        msd_f, count_f = _msd_spectra(pos, n_fft)
+        msd_acc += msd_f
+        count_acc += count_f
+        vacf_f, vacf_count_f = _vacf_spectra(pos, n_fft)
+        vacf_acc += vacf_f
+        vacf_count_acc += vacf_count_f
+
+    # the sum over particles commutes with the inverse transform
+    count = np.rint(np.fft.irfft(count_acc, n_fft)[:T]).astype(np.int64)
+    msd = np.fft.irfft(msd_acc, n_fft)[:T]
+    vacf_count = np.rint(np.fft.irfft(vacf_count_acc, n_fft)[:T - 1]).astype(np.int64)
+    vacf = np.fft.irfft(vacf_acc, n_fft)[:T - 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        msd = np.where(count > 0, msd / np.maximum(count, 1), np.nan)
+        vacf = np.where(vacf_count > 0, vacf / np.maximum(vacf_count, 1), np.nan)
+    msd[0] = np.where(count[0] > 0, 0, np.nan)
+
+    n_lag = T if max_lag is None else min(T, max_lag + 1)
+    return {'lag': np.arange(n_lag) * (frames[1] - frames[0]),
+            'msd': msd[:n_lag],
+            'count': count[:n_lag],
+            'vacf': vacf[:n_lag],
+            'vacf_count': vacf_count[:n_lag],
+            'frames': frames}
+
+
+def write_msd(sms, columns=('x', 'y'), frames=None, max_lag=None, name='msd',
+              over_write=False, **kwargs):
+    '''Computes the mean squared displacement and velocity
+    autocorrelation with :py:func:`compute_msd` and stores them in the
+    run level statistics group `/statistics/name` of `sms`, with the
+    provenance as meta-data on each data set.
+
+    additional kwargs are passed to :py:func:`compute_msd`
+
+    Parameters
+    ----------
+    sms : `~sm_core.data_serialization.SM_serial`
+        file to read from and write to
+    columns : :py:class:`list` of :py:class:`str`
+        names of the position data sets
+    frames : iterable of int or :py:class:`None`
+        frames to use, must be evenly spaced.  Defaults to all frames
+    max_lag : int or :py:class:`None`
+        largest lag (in frames) to compute
+    name : :py:class:`str`
+        name of the group in `/statistics` to write to
+    over_write : bool
+        if existing results should be over written
+
+    Returns
+    -------
+    res : :py:class:`dict`
+        the results, see :py:func:`compute_msd`
+    '''
+    res = compute_msd(sms, columns=columns, frames=frames, max_lag=max_lag, **kwargs)
+    frames = res['frames']
+    md = {'algorithm': 'fft',
+          'columns': ','.join(columns),
+          'first_frame': frames[0],
+          'last_frame': frames[-1],
+          'frame_step': frames[1] - frames[0],
+          'n_frames': len(frames),
+          'n_particles': len(sms.get_series_index(columns[0])[0]),
+          'lag_units': 'frames',
+          'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'writer': 'sm_core/python sm_core.msd'}
+    for key in ('lag', 'msd', 'count', 'vacf', 'vacf_count'):
+        sms.dumps_run_stat(name + '/' + key, res[key], meta_data=md, over_write=over_write)
+    return res
+
+
+def _fft_size(n):
+    """Private function returning the smallest power of 2 >= n
+    """
+    return 1 << int(np.ceil(np.log2(max(n, 2))))
+
+
+def _masked(pos):
+    """Private function to zero the missing positions and subtract the
+    per-particle mean, which leaves displacements unchanged but avoids
+    round off from large coordinates.
+
+    Parameters
+    ----------
+    pos : :py:class:`~numpy.ndarray`
+        positions, shape (n_dims, n_particles, n_frames), NaN if missing
+
+    Returns
+    -------
+    pos : :py:class:`~numpy.ndarray`
+        the positions with 0 where missing
+    mask : :py:class:`~numpy.ndarray`
+        1. where the particle is present, shape (n_particles, n_frames)
+    """
+    mask = np.all(np.isfinite(pos), axis=0)
+    n = np.maximum(mask.sum(axis=-1), 1)
+    pos = np.where(mask, pos, 0)
+    pos -= (pos.sum(axis=-1) / n)[..., np.newaxis]
+    pos *= mask
+    return pos, mask.astype(np.float64)
+
+
+def _msd_spectra(pos, n_fft):
+    """Private function returning the transforms (summed over
+    particles) of the sum of squared displacements and of the number of
+    displacements, as a function of lag.
+
+    With the mask m, the sum over i of m_i m_{i+k} (x_{i+k} - x_i)^2
+    expands into correlations of m with x^2 and of x with itself.
+    """
+    pos, mask = _masked(pos)
+    f_mask = np.fft.rfft(mask, n_fft)
+    f_sq = np.fft.rfft((pos ** 2).sum(axis=0), n_fft)
+    f_pos = np.fft.rfft(pos, n_fft)
+    num = 2 * (f_mask.conj() * f_sq).real - 2 * (np.abs(f_pos) ** 2).sum(axis=0)
+    return num.sum(axis=0), (np.abs(f_mask) ** 2).sum(axis=0)
+
+
+def _vacf_spectra(pos, n_fft):
+    """Private function returning the transforms (summed over
+    particles) of the sum of velocity products and their number, as a
+    function of lag.
+    """
+    vel = pos[..., 1:] - pos[..., :-1]
+    mask = np.all(np.isfinite(vel), axis=0)
+    vel = np.where(mask, vel, 0)
+    f_vel = np.fft.rfft(vel, n_fft)
+    f_mask = np.fft.rfft(mask.astype(np.float64), n_fft)
+    return (np.abs(f_vel) ** 2).sum(axis=(0, 1)), (np.abs(f_mask) ** 2).sum(axis=0)
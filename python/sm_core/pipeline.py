@@ -0,0 +1,283 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import time
+import traceback
+import multiprocessing
+import numpy as np
+
+'''
+Parallel ingest: worker processes compute frames, the calling process
+is the only one writing to the file.
+
+Arrays are handed from the workers to the writer through a pool of
+shared memory slots, only their layout is pickled.  The writer commits
+the frames in order, keeping at most one frame per slot in flight, so
+the reorder buffer is bounded.  If a worker dies its frames are
+recomputed by a fresh worker.  The frames ready to write are committed
+together as one transaction, so however the ingest ends the file holds
+an in-order prefix of whole frames.
+'''
+
+_ALIGN = 64   #: alignment of the arrays in a slot
+
+
+def ingest(sms, func, frames, n_workers=None, n_slots=None, slot_bytes=2 ** 26,
+           max_retries=2, over_write=False, progress=None):
+    '''Computes frames with `func` in worker processes and writes them
+    to `sms` in the order of `frames`.
+
+    Parameters
+    ----------
+    sms : `~sm_core.data_serialization.SM_serial`
+        writable file to store the frames in
+    func : callable
+        `func(frame_num)` returns a :py:class:`dict` mapping data set
+        names to arrays, or a tuple of that and a :py:class:`dict` of
+        frame meta-data.  Called in the worker processes
+    frames : iterable of int
+        the frames to compute, in the order they are written
+    n_workers : int or :py:class:`None`
+        number of worker processes, defaults to the number of cpus
+    n_slots : int or :py:class:`None`
+        number of shared memory slots, which is also the most frames
+        in flight at once.  Defaults to twice `n_workers`
+    slot_bytes : int
+        size of each slot, frames that do not fit are pickled instead
+    max_retries : int
+        how often a frame is recomputed after its worker died before
+        giving up
+    over_write : bool
+        passed on to :py:func:`dumps` and :py:func:`set_frame_md`
+    progress : callable or :py:class:`None`
+        called with the statistics (see below) after every commit
+
+    Returns
+    -------
+    stats : :py:class:`dict`
+        'frames', 'bytes', 'elapsed' (s), 'frames_per_s', 'mb_per_s',
+        'max_reorder' (largest number of frames waiting for an earlier
+        one), 'mean_in_flight' (frames dispatched but not written,
+        averaged over the commits), 'restarts' (workers replaced) and
+        'pickled' (frames that did not fit in a slot)
+    '''
+    frames = list(frames)
+    if not frames:
+        raise ValueError("no frames to ingest")
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(1, min(n_workers, len(frames)))
+    if n_slots is None:
+        n_slots = 2 * n_workers
+    n_slots = max(1, n_slots)
+
+    slots = [multiprocessing.RawArray('b', slot_bytes) for _ in range(n_slots)]
+    workers = [_Worker(func, slots) for _ in range(n_workers)]
+    stats = {'frames': 0, 'bytes': 0, 'elapsed': 0., 'frames_per_s': 0.,
+             'mb_per_s': 0., 'max_reorder': 0, 'mean_in_flight': 0.,
+             'restarts': 0, 'pickled': 0}
+    free_slots = list(range(n_slots))
+    retries = [0] * len(frames)
+    pending = {}
+    next_dispatch = next_commit = 0
+    in_flight_sum = 0
+    start = time.time()
+    try:
+        while next_commit < len(frames):
+            # keep every slot busy, never running ahead more than n_slots frames
+            while (next_dispatch < len(frames) and free_slots and
+                   next_dispatch < next_commit + n_slots):
+                worker = min(workers, key=lambda w: len(w.tasks))
+                worker.send(next_dispatch, frames[next_dispatch], free_slots.pop())
+                next_dispatch += 1
+
+            got_result = False
+            for j, worker in enumerate(workers):
+                try:
+                    msg = worker.poll()
+                except (EOFError, IOError):
+                    msg = None
+                    worker.dead = True
+                if msg is not None:
+                    got_result = True
+                    if msg[0] == 'error':
+                        raise RuntimeError("computing frame {0} failed:\n{1}".format(
+                            frames[msg[1]], msg[2]))
+                    _, idx, layout, inline, md = msg
+                    slot = worker.tasks.pop(idx)
+                    pending[idx] = (slot, layout, inline, md)
+                    stats['max_reorder'] = max(stats['max_reorder'], len(pending) - (next_commit in pending))
+                if worker.dead or not worker.is_alive():
+                    # reassign its frames to a fresh worker, the slots are
+                    # free to reuse as the old process is gone
+                    for idx in worker.tasks:
+                        retries[idx] += 1
+                        if retries[idx] > max_retries:
+                            raise RuntimeError("worker died computing frame {0} {1} times".format(
+                                frames[idx], retries[idx]))
+                    worker.close()
+                    workers[j] = _Worker(func, slots)
+                    for idx, slot in sorted(worker.tasks.items()):
+                        workers[j].send(idx, frames[idx], slot)
+                    stats['restarts'] += 1
+
+            if next_commit in pending:
+                # the frames ready to write go in as one transaction
+                with sms.transaction():
+                    while next_commit in pending:
+                        slot, layout, inline, md = pending.pop(next_commit)
+                        in_flight_sum += next_dispatch - next_commit
+                        stats['bytes'] += _commit(sms, frames[next_commit], slots[slot],
+                                                  layout, inline, md, over_write)
+                        stats['pickled'] += bool(inline)
+                        free_slots.append(slot)
+                        next_commit += 1
+                stats['frames'] = next_commit
+                stats['elapsed'] = time.time() - start
+                stats['frames_per_s'] = next_commit / max(stats['elapsed'], 1e-9)
+                stats['mb_per_s'] = stats['bytes'] / 1e6 / max(stats['elapsed'], 1e-9)
+                stats['mean_in_flight'] = in_flight_sum / float(next_commit)
+                if progress is not None:
+                    progress(dict(stats))
+            if not got_result:
+                time.sleep(.001)
+    finally:
+        for worker in workers:
+            worker.stop()
+        sms.flush()
+    return stats
+
+
+def _commit(sms, frame_num, slot, layout, inline, md, over_write):
+    """Private function to write one frame, returns the number of bytes
+    of array data written.
+    """
+    buf = np.frombuffer(slot, dtype=np.uint8)
+    n_bytes = 0
+    for name, dtype, shape, offset in layout:
+        count = int(np.prod(shape))
+        data = buf[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+        sms.dumps(frame_num, name, data, over_write=over_write)
+        n_bytes += data.nbytes
+    for name in sorted(inline):
+        sms.dumps(frame_num, name, inline[name], over_write=over_write)
+        n_bytes += np.asarray(inline[name]).nbytes
+    if md:
+        sms.set_frame_md(frame_num, md, over_write=over_write)
+    return n_bytes
+
+
+class _Worker(object):
+    """Private class for the writer side of a worker process, which
+    owns the pipe to it and the frames it is working on.
+    """
+    def __init__(self, func, slots):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(target=_work, args=(func, child_conn, slots))
+        self.proc.daemon = True
+        self.proc.start()
+        child_conn.close()
+        self.tasks = {}   # frame index -> slot
+        self.dead = False
+
+    def send(self, idx, frame_num, slot):
+        self.tasks[idx] = slot
+        try:
+            self.conn.send((idx, frame_num, slot))
+        except IOError:
+            # the worker died, the task is reassigned with the others
+            self.dead = True
+
+    def poll(self):
+        if self.conn.poll():
+            return self.conn.recv()
+        return None
+
+    def is_alive(self):
+        return self.proc.is_alive()
+
+    def close(self):
+        self.conn.close()
+        self.proc.join(1)
+
+    def stop(self):
+        if self.proc.is_alive():
+            try:
+                self.conn.send(None)
+            except IOError:
+                pass
+            self.proc.join(1)
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join()
+        self.conn.close()
+
+
+def _work(func, conn, slots):
+    """Private function run in the worker processes
+    """
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        idx, frame_num, slot = task
+        try:
+            res = func(frame_num)
+            if isinstance(res, tuple):
+                data, md = res
+            else:
+                data, md = res, None
+            data = dict((name, np.ascontiguousarray(value)) for name, value in data.items())
+            layout, inline = _pack(data, np.frombuffer(slots[slot], dtype=np.uint8))
+            conn.send(('ok', idx, layout, inline, md))
+        except Exception:
+            conn.send(('error', idx, traceback.format_exc()))
+    conn.close()
+
+
+def _pack(data, buf):
+    """Private function to copy the arrays in `data` into `buf`.
+
+    Returns
+    -------
+    layout : :py:class:`list`
+        (name, dtype, shape, offset) of each array in `buf`
+    inline : :py:class:`dict`
+        the arrays, if they do not fit in `buf`
+    """
+    layout = []
+    offset = 0
+    for name in sorted(data):
+        arr = data[name]
+        if offset + arr.nbytes > len(buf):
+            return [], data
+        buf[offset:offset + arr.nbytes] = arr.reshape(-1).view(np.uint8)
+        layout.append((name, arr.dtype, arr.shape, offset))
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    return layout, {}
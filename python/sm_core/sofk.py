@@ -0,0 +1,247 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+import time
+import numpy as np
+
+'''
+Static structure factor S(k).
+
+The particles of a frame are binned onto a regular grid covering the
+(periodic) box, the grid is Fourier transformed and the power is
+averaged over shells of wave number k.  This costs one `bincount` over the
+particles and one FFT of the grid per frame, independent of the
+number of wave vectors, so frames with 10^6 particles are cheap.  The
+nearest grid point assignment is corrected for by dividing the
+correlated part by the window function, and by default only wave vectors below half the grid
+Nyquist frequency are used, where the aliasing is small.
+'''
+
+
+def make_k_bins(box, n_grid=64, n_bins=None, k_max=None):
+    '''Returns the default edges of the k shells for a box
+
+    Parameters
+    ----------
+    box : sequence of float
+        the length of the box in each dimension
+    n_grid : int or sequence of int
+        number of grid points in each dimension
+    n_bins : int or :py:class:`None`
+        number of shells, defaults to one per fundamental wave number
+    k_max : float or :py:class:`None`
+        upper edge of the last shell, defaults to half the smallest
+        Nyquist wave number of the grid
+
+    Returns
+    -------
+    edges : :py:class:`~numpy.ndarray`
+        the shell edges, starting at the smallest non-zero wave number
+    '''
+    box = np.asarray(box, dtype=np.float64)
+    n_grid = np.broadcast_to(n_grid, box.shape)
+    k_min = 2 * np.pi / box.max()
+    if k_max is None:
+        k_max = (np.pi * n_grid / box).min() / 2
+    if n_bins is None:
+        n_bins = max(1, int(np.floor(k_max / (2 * np.pi / box.min()))))
+    return np.linspace(k_min * (1 - 1e-9), k_max, n_bins + 1)
+
+
+def compute_sofk(positions, box, k_bins, n_grid=64, deconvolve=True):
+    '''Computes S(k) of one frame, averaged over shells of wave number k.
+
+    Parameters
+    ----------
+    positions : :py:class:`~numpy.ndarray`
+        positions, shape (n_particles, n_dims).  Positions are wrapped
+        into the box, which starts at the origin
+    box : sequence of float
+        the length of the box in each dimension
+    k_bins : :py:class:`~numpy.ndarray`
+        edges of the k shells, see :py:func:`make_k_bins`
+    n_grid : int or sequence of int
+        number of grid points in each dimension
+    deconvolve : bool
+        if the nearest grid point window should be divided out
+
+    Returns
+    -------
+    k : :py:class:`~numpy.ndarray`
+        mean k of the modes in each shell
+    s : :py:class:`~numpy.ndarray`
+        S(k), NaN for empty shells
+    count : :py:class:`~numpy.ndarray`
+        number of wave vectors in each shell
+    '''
+    positions = np.asarray(positions, dtype=np.float64)
+    box = np.asarray(box, dtype=np.float64)
+    n_part, n_dim = positions.shape
+    if len(box) != n_dim:
+        raise ValueError("box must have one length per dimension")
+    n_grid = tuple(int(n) for n in np.broadcast_to(n_grid, box.shape))
+
+    # nearest grid point density
+    idx = np.floor(np.mod(positions, box) / box * n_grid).astype(np.intp)
+    for d in range(n_dim):
+        np.clip(idx[:, d], 0, n_grid[d] - 1, out=idx[:, d])
+    rho = np.bincount(np.ravel_multi_index(idx.T, n_grid),
+                      minlength=int(np.prod(n_grid))).reshape(n_grid)
+    power = np.abs(np.fft.rfftn(rho)) ** 2 / max(n_part, 1)
+
+    k_mag, weight, window = _mode_grid(box, n_grid)
+    if deconvolve:
+        # the aliased shot noise of nearest grid point binning sums to
+        # exactly 1, only the correlated part is suppressed by the window
+        power = (power - 1) / window ** 2 + 1
+
+    k_mag, weight, power = k_mag.ravel(), weight.ravel(), power.ravel()
+    shell = np.searchsorted(k_bins, k_mag, side='right') - 1
+    use = (shell >= 0) & (shell < len(k_bins) - 1) & (k_mag > 0)
+    n_shell = len(k_bins) - 1
+    count = np.bincount(shell[use], weights=weight[use], minlength=n_shell)
+    s_sum = np.bincount(shell[use], weights=(weight * power)[use], minlength=n_shell)
+    k_sum = np.bincount(shell[use], weights=(weight * k_mag)[use], minlength=n_shell)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return k_sum / count, s_sum / count, count.astype(np.int64)
+
+
+def _exists(func, *args):
+    """Private function returning if `func(*args)` finds what it
+    looks up, that is does not raise `KeyError`
+    """
+    try:
+        func(*args)
+    except KeyError:
+        return False
+    return True
+
+
+def _mode_grid(box, n_grid):
+    """Private function returning k, the multiplicity (modes with
+    a partner at -k which the real FFT leaves out count twice) and the
+    nearest grid point window of the modes of a real FFT of the grid.
+    """
+    # integer mode numbers along each axis
+    axes = [np.fft.fftfreq(n, d=1. / n) for n in n_grid[:-1]]
+    axes.append(np.fft.rfftfreq(n_grid[-1], d=1. / n_grid[-1]))
+    m = np.meshgrid(*axes, indexing='ij')
+    k_sq = sum((2 * np.pi * mi / L) ** 2 for mi, L in zip(m, box))
+    window = np.ones_like(k_sq)
+    for mi, n in zip(m, n_grid):
+        window *= np.sinc(mi / n)
+    last = m[-1]
+    weight = np.where((last == 0) | ((n_grid[-1] % 2 == 0) & (last == n_grid[-1] // 2)), 1., 2.)
+    return np.sqrt(k_sq), weight, window
+
+
+def sofk(sms, box, columns=('x', 'y'), frames=None, n_grid=64, k_bins=None,
+         name='sofk', run_average=True, over_write=False):
+    '''Computes S(k) for each frame, stores it in `/time_*/statistics/name`
+    and, optionally, the average over the frames in the run level
+    statistics `/statistics/name`.
+
+    The shells are the same for all frames, their mean k is stored
+    in `/statistics/name/k`.
+
+    Parameters
+    ----------
+    sms : `~sm_core.data_serialization.SM_serial`
+        file to read from and write to
+    box : sequence of float
+        the length of the (periodic) box in each dimension
+    columns : :py:class:`list` of :py:class:`str`
+        names of the position data sets, one per dimension
+    frames : iterable of int or :py:class:`None`
+        frames to use, defaults to all frames
+    n_grid : int or sequence of int
+        number of grid points in each dimension
+    k_bins : :py:class:`~numpy.ndarray` or :py:class:`None`
+        edges of the k shells, defaults to :py:func:`make_k_bins`
+    name : :py:class:`str`
+        name of the data sets to write
+    run_average : bool
+        if the average over the frames should be stored
+    over_write : bool
+        if existing results should be over written
+
+    Returns
+    -------
+    k : :py:class:`~numpy.ndarray`
+        mean k of each shell
+    s_mean : :py:class:`~numpy.ndarray`
+        S(k) averaged over the frames
+    '''
+    if len(columns) != len(box):
+        raise ValueError("need one column per dimension of the box")
+    frames = sms.list_frames() if frames is None else list(frames)
+    if k_bins is None:
+        k_bins = make_k_bins(box, n_grid)
+    if not over_write:
+        # check everything up front, so nothing is half written
+        for frame in frames:
+            if _exists(sms.loads_frame_stat, frame, name):
+                raise RuntimeError("frame {0} already has statistics {1}, "
+                                   "trying to over-write them".format(frame, name))
+        run_names = ['k', 'count'] + (['sofk'] if run_average else [])
+        for stat in run_names:
+            if _exists(sms.get_run_stat_md, name + '/' + stat):
+                raise RuntimeError("trying to over-write existing statistics "
+                                   "{0}".format(name + '/' + stat))
+    md = {'algorithm': 'fft ngp',
+          'columns': ','.join(columns),
+          'box': np.asarray(box, dtype=np.float64),
+          'n_grid': np.broadcast_to(n_grid, (len(box),)).astype(np.int64),
+          'k_bins': k_bins,
+          'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'writer': 'sm_core/python sm_core.sofk'}
+
+    s_total = np.zeros(len(k_bins) - 1)
+    n_frames = 0
+    k = None
+    for frame in frames:
+        positions = np.column_stack([sms.loads(frame, col) for col in columns])
+        k, s, count = compute_sofk(positions, box, k_bins, n_grid=n_grid)
+        frame_md = dict(md)
+        frame_md['n_particles'] = len(positions)
+        sms.dumps_frame_stat(frame, name, s, meta_data=frame_md, over_write=over_write)
+        s_total += s
+        n_frames += 1
+    if k is None:
+        raise ValueError("no frames to compute S(k) of")
+
+    s_mean = s_total / n_frames
+    md['n_frames'] = n_frames
+    md['first_frame'] = min(frames)
+    md['last_frame'] = max(frames)
+    sms.dumps_run_stat(name + '/k', k, meta_data=md, over_write=over_write)
+    sms.dumps_run_stat(name + '/count', count, meta_data=md, over_write=over_write)
+    if run_average:
+        sms.dumps_run_stat(name + '/sofk', s_mean, meta_data=md, over_write=over_write)
+    return k, s_mean
@@ -0,0 +1,187 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+
+import string
+import random
+import infra
+import numpy as np
+from contextlib import closing
+from sm_core import data_serialization as ds
+from sm_core import backends
+import os
+
+N = 6   # parameter for random name
+
+
+def _random_name(base_path, prefix, ext):
+    # hacky version of generating a random name
+    return os.path.join(base_path,
+                        ''.join((prefix,
+                                 ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                 ext)))
+
+
+def _fill(test_sms, M):
+    test_sms.set_summary('x', bins=5, hist_range=(0, 1))
+    test_sms.set_delta_encoding('y', keyframe_interval=4, max_error=1e-3)
+    test_sms.set_frame_md(0, {'complex': 1 + 1j, 'list': range(5), 'string': 'abc'})
+    for k in range(M):
+        test_sms.dumps(k, 'x', np.random.rand(20), meta_data={'k': k})
+        test_sms.dumps(k, 'y', np.arange(20) + k * .01)
+        test_sms.dumps(k, 'n', np.arange(20, dtype=np.int16))
+    test_sms.build_series(['x'])
+
+
+def _check_same(sms_a, sms_b):
+    frames = sms_a.list_frames()
+    assert frames == sms_b.list_frames()
+    for k in frames:
+        assert sorted(sms_a.list_dsets(k)) == sorted(sms_b.list_dsets(k))
+        for name in ('x', 'y', 'n'):
+            a = sms_a.loads(k, name)
+            b = sms_b.loads(k, name)
+            assert a.dtype == b.dtype
+            assert np.all(a == b)
+        assert sms_a.get_dset_md(k, 'x')['k'] == sms_b.get_dset_md(k, 'x')['k']
+    md_a = sms_a.get_frame_md(0)
+    md_b = sms_b.get_frame_md(0)
+    assert md_a['complex'] == md_b['complex']
+    assert md_a['string'] == md_b['string']
+    assert np.all(md_a['list'] == md_b['list'])
+    assert np.all(sms_a.get_summary('x') == sms_b.get_summary('x'))
+    assert np.all(sms_a.loads_series(range(20), 'x') == sms_b.loads_series(range(20), 'x'))
+
+
+def test_npy_round_trip():
+    M = 10  # number of frames to dump
+    with infra.path_provider() as base_path:
+        tmp_fname = _random_name(base_path, 'test_npy_', '')
+        test_data = [(np.dtype(t), np.arange(50, dtype=t))
+                     for t in ('int8', 'uint64', 'float32', 'float64', 'complex128')]
+
+        with closing(ds.SM_serial.open(tmp_fname, 'w', backend='npy')) as test_sms:
+            for k in range(M):
+                for dtype, data in test_data:
+                    test_sms.dumps(k, dtype.name, data)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r', backend='npy')) as test_sms:
+            for k in range(M):
+                for dtype, data in test_data:
+                    read_data = test_sms.loads(k, dtype.name)
+                    assert isinstance(read_data, np.memmap)
+                    assert not read_data.flags.writeable
+                    assert read_data.dtype == dtype
+                    assert np.all(read_data == data)
+                    buf = np.empty_like(data)
+                    assert test_sms.loads(k, dtype.name, out=buf) is buf
+                    assert np.all(buf == data)
+            try:
+                test_sms.dumps(0, 'new', np.arange(5))
+            except RuntimeError:
+                pass
+            else:
+                assert False
+
+        # 'w' truncates an existing file, but no other directory
+        with closing(ds.SM_serial.open(tmp_fname, 'w', backend='npy')) as test_sms:
+            assert test_sms.list_frames() == []
+        other = _random_name(base_path, 'test_npy_other_', '')
+        os.makedirs(other)
+        with open(os.path.join(other, 'keep.txt'), 'w') as f:
+            f.write('data')
+        try:
+            ds.SM_serial.open(other, 'w', backend='npy')
+        except IOError:
+            pass
+        else:
+            assert False
+        assert os.path.isfile(os.path.join(other, 'keep.txt'))
+
+
+def test_convert():
+    M = 9  # number of frames to dump
+    with infra.path_provider() as base_path:
+        h5_fname = _random_name(base_path, 'test_convert_', '.h5')
+        npy_fname = _random_name(base_path, 'test_convert_', '')
+        h5_fname2 = _random_name(base_path, 'test_convert_', '.h5')
+
+        with closing(ds.SM_serial.open(h5_fname, 'w')) as test_sms:
+            _fill(test_sms, M)
+        backends.convert(h5_fname, npy_fname, 'hdf5', 'npy')
+        backends.convert(npy_fname, h5_fname2, 'npy', 'hdf5', compression='gzip')
+
+        with closing(ds.SM_serial.open(h5_fname, 'r')) as sms_a:
+            with closing(ds.SM_serial.open(npy_fname, 'r', backend='npy')) as sms_b:
+                _check_same(sms_a, sms_b)
+            with closing(ds.SM_serial.open(h5_fname2, 'r')) as sms_b:
+                _check_same(sms_a, sms_b)
+
+        # the summary table stays appendable after the conversion
+        with closing(ds.SM_serial.open(npy_fname, 'a', backend='npy')) as test_sms:
+            test_sms.set_summary('x', bins=5, hist_range=(0, 1))
+            test_sms.dumps(M, 'x', np.random.rand(20))
+            assert len(test_sms.get_summary('x')) == M + 1
+
+
+def test_npy_backend_features():
+    M = 9  # number of frames to dump
+    with infra.path_provider() as base_path:
+        npy_fname = _random_name(base_path, 'test_npy_', '')
+        h5_fname = _random_name(base_path, 'test_npy_', '.h5')
+        with closing(ds.SM_serial.open(npy_fname, 'w', backend='npy')) as test_sms:
+            _fill(test_sms, M)
+        with closing(ds.SM_serial.open(npy_fname, 'r', backend='npy')) as test_sms:
+            assert len(test_sms.get_summary('x')) == M
+            assert test_sms.get_dset_md(1, 'y')['sm_encoding'] == 'delta'
+        backends.convert(npy_fname, h5_fname, 'npy', 'hdf5')
+        with closing(ds.SM_serial.open(h5_fname, 'r')) as sms_a:
+            with closing(ds.SM_serial.open(npy_fname, 'r', backend='npy')) as sms_b:
+                _check_same(sms_a, sms_b)
+
+
+def test_npy_transaction():
+    M = 5  # number of frames to dump
+    with infra.path_provider() as base_path:
+        npy_fname = _random_name(base_path, 'test_npy_txn_', '')
+        x = np.random.rand(M, 20)
+        with closing(ds.SM_serial.open(npy_fname, 'w', backend='npy')) as test_sms:
+            with test_sms.transaction():
+                for k in range(M):
+                    test_sms.dumps(k, 'x', x[k], meta_data={'k': k})
+                test_sms.set_frame_md(0, {'string': 'abc'})
+                test_sms.dumps(0, 'x', x[0] * 2, over_write=True)
+            assert sorted(os.listdir(npy_fname)) == ['.attrs.json', 'parameters'] + \
+                [test_sms._format_frame_name(k) for k in range(M)]
+        with closing(ds.SM_serial.open(npy_fname, 'r', backend='npy')) as test_sms:
+            assert test_sms.list_frames() == range(M)
+            assert np.all(test_sms.loads(0, 'x') == x[0] * 2)
+            assert np.all(test_sms.loads(3, 'x') == x[3])
+            assert test_sms.get_dset_md(3, 'x')['k'] == 3
+            assert test_sms.get_frame_md(0)['string'] == 'abc'
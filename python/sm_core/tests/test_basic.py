@@ -28,8 +28,11 @@
 #either expressed or implied, of the FreeBSD Project.
 #
 
+import sys
+import json
 import string
 import random
+import subprocess
 import infra
 import numpy as np
 from contextlib import closing
@@ -228,3 +231,540 @@ def test_dset_md_update_fail():
             read_md = test_sms.get_dset_md(0, dset_name)
             print read_md
             assert [read_md[k] == md_test[k] for k in md_test.keys()]
+
+
+def test_delta_round_trip():
+    M = 25  # number of frames to dump
+    max_error = 1e-4
+    base = np.random.rand(100) * 50
+    steps = np.random.randn(M, 100) * 0.01
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_delta_roundtrip_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        frames = base + np.cumsum(steps, axis=0)
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_delta_encoding('x', keyframe_interval=10, max_error=max_error)
+            for k in range(M):
+                test_sms.dumps(k, 'x', frames[k])
+                test_sms.dumps(k, 'raw', frames[k])
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            # read in a scrambled order to exercise the random access
+            for k in np.random.permutation(M):
+                read_data = test_sms.loads(k, 'x')
+                assert read_data.dtype == frames.dtype
+                assert np.all(np.abs(read_data - frames[k]) <= max_error * (1 + 1e-6))
+                assert np.all(test_sms.loads(k, 'raw') == frames[k])
+                md = test_sms.get_dset_md(k, 'x')
+                if k % 10:
+                    assert md['sm_encoding'] == 'delta'
+                    assert md['sm_keyframe'] == k - k % 10
+                    assert md['sm_error'] <= max_error * (1 + 1e-6)
+                else:
+                    assert md['sm_encoding'] == 'keyframe'
+
+
+def test_delta_keyframe_over_write_fail():
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_delta_over_write_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_delta_encoding('x', keyframe_interval=5, max_error=1e-3)
+            for k in range(3):
+                test_sms.dumps(k, 'x', np.arange(50, dtype=float) + k * .1)
+            try:
+                test_sms.dumps(0, 'x', np.zeros(50), over_write=True)
+                # this should fail and raise a RuntimeError
+            except RuntimeError:
+                pass
+            else:
+                # if this gets hit, something is wrong
+                assert False
+            # frames nothing depends on can be replaced
+            test_sms.dumps(2, 'x', np.ones(50), over_write=True)
+            assert np.all(np.abs(test_sms.loads(2, 'x') - 1) <= 1e-3)
+
+            # a longer interval set later does not reach past the interval
+            # stored with the keyframe, which bounds the dependents check
+            test_sms.set_delta_encoding('y', keyframe_interval=2, max_error=1e-3)
+            test_sms.dumps(0, 'y', np.arange(50, dtype=float))
+            test_sms.set_delta_encoding('y', keyframe_interval=10, max_error=1e-3)
+            test_sms.dumps(5, 'y', np.arange(50, dtype=float) + .5)
+            assert test_sms.get_dset_md(5, 'y')['sm_encoding'] == 'keyframe'
+            test_sms.dumps(0, 'y', np.arange(50) * 100., over_write=True)
+            assert np.all(test_sms.loads(5, 'y') == np.arange(50) + .5)
+
+            # deltas which can not meet max_error are stored as keyframes,
+            # here the step is close to the spacing of the floats
+            test_sms.set_delta_encoding('z', keyframe_interval=5, max_error=1e-16)
+            test_sms.dumps(0, 'z', np.full(50, .75))
+            test_sms.dumps(1, 'z', np.full(50, .75) + np.linspace(0, 1e-13, 50))
+            md = test_sms.get_dset_md(1, 'z')
+            assert md['sm_encoding'] == 'keyframe'
+
+
+def test_series_round_trip():
+    M = 30  # number of frames to dump
+    P = 40  # number of particles
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_series_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(M, P)
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            for k in range(M):
+                test_sms.dumps(k, 'x', x[k])
+                # every frame is missing one track
+                keep = np.arange(P) != k % P
+                test_sms.dumps(k, 'track_id', np.arange(P)[keep][::-1] + 100)
+                test_sms.dumps(k, 'y', x[k][keep][::-1])
+            test_sms.build_series(['x'], block_frames=7, chunk_particles=8)
+            # blocks of 3 frames
+            test_sms.build_series(['y'], id_column='track_id', max_bytes=3 * P * 8)
+            assert test_sms._file['series/y/data'].chunks[1] == 3
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            assert np.all(test_sms.loads_series(np.arange(P), 'x') == x.T)
+            read_data = test_sms.loads_series([5, 3, 3], 'x', frames=[20, 2])
+            assert np.all(read_data == x[[20, 2]][:, [5, 3, 3]].T)
+
+            read_data = test_sms.loads_series([103], 'y')[0]
+            assert np.isnan(read_data[3])
+            keep = np.arange(M) != 3
+            assert np.all(read_data[keep] == x[keep, 3])
+            try:
+                test_sms.loads_series([P + 100], 'y')
+            except KeyError:
+                pass
+            else:
+                assert False
+
+        # a failed rebuild leaves the existing series as they were
+        with closing(ds.SM_serial.open(tmp_fname, 'r+')) as test_sms:
+            test_sms.dumps(M, 'x', np.zeros(P + 1))
+            try:
+                test_sms.build_series(['x'])
+            except ValueError:
+                pass
+            else:
+                assert False
+            assert '_series_build' not in test_sms._file
+            assert np.all(test_sms.loads_series(np.arange(P), 'x') == x.T)
+
+
+def test_summary():
+    M = 12  # number of frames to dump
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_summary_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(M, 200)
+        x[3, 5] = np.nan
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_summary('x', bins=10, hist_range=(0, 1))
+            test_sms.set_summary('n')
+            for k in range(M)[::-1]:
+                test_sms.dumps(k, 'x', x[k])
+                test_sms.dumps(k, 'n', np.arange(k + 1))
+            test_sms.dumps(0, 'x', x[0] / 2, over_write=True)
+        x[0] /= 2
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            summary = test_sms.get_summary('x')
+            assert np.all(summary['frame'] == np.arange(M))
+            for k, row in enumerate(summary):
+                finite = x[k][np.isfinite(x[k])]
+                assert row['count'] == len(finite)
+                assert row['min'] == finite.min()
+                assert row['max'] == finite.max()
+                assert np.allclose(row['mean'], finite.mean())
+                assert np.allclose(row['var'], finite.var())
+                assert np.all(row['hist'] == np.histogram(finite, 10, (0, 1))[0])
+
+            summary = test_sms.get_summary('n', frames=[4, 2])
+            assert np.all(summary['frame'] == [2, 4])
+            assert np.all(summary['count'] == [3, 5])
+            assert 'hist' not in summary.dtype.names
+
+
+def test_memory_backend():
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_memory_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        test_data = np.arange(50)
+        with closing(ds.SM_serial.open(tmp_fname, 'w', backend='memory')) as test_sms:
+            test_sms.dumps(0, 'test', test_data)
+            image = test_sms.to_bytes()
+        assert not os.path.exists(tmp_fname)
+
+        with closing(ds.SM_serial.from_bytes(image, 'r+')) as test_sms:
+            assert np.all(test_sms.loads(0, 'test') == test_data)
+            test_sms.dumps(1, 'test', test_data * 2)
+            image2 = test_sms.to_bytes()
+
+        with closing(ds.SM_serial.from_bytes(image2)) as test_sms:
+            assert test_sms.list_frames() == [0, 1]
+            assert np.all(test_sms.loads(1, 'test') == test_data * 2)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'w', backend='memory',
+                                       write_through=True)) as test_sms:
+            test_sms.dumps(0, 'test', test_data)
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            assert np.all(test_sms.loads(0, 'test') == test_data)
+
+
+def test_loads_out():
+    M = 6  # number of frames to dump
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_loads_out_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(M, 30)
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_delta_encoding('d', keyframe_interval=3, max_error=1e-6)
+            for k in range(M):
+                test_sms.dumps(k, 'x', x[k])
+                test_sms.dumps(k, 'd', x[k])
+            test_sms.build_series(['x'])
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            buf = np.empty(30)
+            for name in ('x', 'd'):
+                for k, read_data in test_sms.iterloads(name, out=buf):
+                    assert read_data is buf
+                    assert np.allclose(buf, x[k], rtol=0, atol=1e-6)
+
+            for bad in (np.empty(31), np.empty(30, dtype=np.float32), np.empty(60)[::2]):
+                try:
+                    test_sms.loads(0, 'x', out=bad)
+                except ValueError:
+                    pass
+                else:
+                    assert False
+
+            buf = np.empty((5, 3))
+            assert test_sms.loads_series(range(2, 7), 'x', frames=[1, 2, 3], out=buf) is buf
+            assert np.all(buf == x[1:4, 2:7].T)
+            test_sms.loads_series([6, 2, 3, 4, 5], 'x', frames=[3, 1, 2], out=buf)
+            assert np.all(buf == x[[3, 1, 2]][:, [6, 2, 3, 4, 5]].T)
+            buf = np.empty((0, 3))
+            assert test_sms.loads_series([], 'x', frames=[1, 2, 3], out=buf) is buf
+
+
+def test_storage_precision():
+    M = 5  # number of frames to dump
+    max_error = 1e-4
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_precision_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(M, 100) * 300 - 50
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_storage_precision('fixed', 'fixed', max_error=max_error)
+            test_sms.set_storage_precision('narrow', 'float32')
+            try:
+                test_sms.set_delta_encoding('fixed', keyframe_interval=3, max_error=1)
+            except ValueError:
+                pass
+            else:
+                assert False
+            for k in range(M):
+                test_sms.dumps(k, 'fixed', x[k])
+                test_sms.dumps(k, 'narrow', x[k])
+                test_sms.dumps(k, 'ints', np.arange(5))
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            for k in range(M):
+                read_data = test_sms.loads(k, 'fixed')
+                assert read_data.dtype == np.float64
+                assert np.all(np.abs(read_data - x[k]) <= max_error * (1 + 1e-6))
+                md = test_sms.get_dset_md(k, 'fixed')
+                assert md['sm_encoding'] == 'fixed'
+                assert md['sm_error'] <= max_error * (1 + 1e-6)
+
+                buf = np.empty(100)
+                test_sms.loads(k, 'fixed', out=buf)
+                assert np.all(buf == read_data)
+
+                read_data = test_sms.loads(k, 'narrow')
+                assert read_data.dtype == np.float64
+                assert np.all(read_data == x[k].astype(np.float32))
+                test_sms.loads(k, 'narrow', out=buf)
+                assert np.all(buf == read_data)
+
+                assert test_sms.loads(k, 'ints').dtype == np.arange(5).dtype
+            # check what is actually on disk
+            assert test_sms._file['time_0000000/particles/fixed'].dtype == np.uint32
+            assert test_sms._file['time_0000000/particles/narrow'].dtype == np.float32
+
+
+def test_storage_precision_fallback():
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_precision_fallback_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        big = np.array([0., 1e300])
+        # more steps than a uint64 (or a float64 mantissa) can hold
+        wide = np.array([0., 2. ** 60])
+        # the rounding error of adding the offset back exceeds max_error
+        coarse = np.array([231982.13337249, 259260.75699008])
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_storage_precision('narrow', 'float32')
+            test_sms.set_storage_precision('wide', 'fixed', max_error=0.5)
+            test_sms.set_storage_precision('coarse', 'fixed', max_error=1e-12)
+            test_sms.dumps(0, 'narrow', big)
+            test_sms.dumps(0, 'wide', wide)
+            test_sms.dumps(0, 'coarse', coarse)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            for name, data in (('narrow', big), ('wide', wide), ('coarse', coarse)):
+                assert np.all(test_sms.loads(0, name) == data)
+                assert 'sm_encoding' not in test_sms.get_dset_md(0, name)
+                assert test_sms._file['time_0000000/particles/' + name].dtype == np.float64
+
+
+def test_cache():
+    M = 6  # number of frames to dump
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_cache_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(M, 100)
+        # room for 3 frames
+        cache = ds.ArrayCache(3 * x[0].nbytes)
+        with closing(ds.SM_serial.open(tmp_fname, 'w', cache=cache)) as test_sms:
+            for k in range(M):
+                test_sms.dumps(k, 'x', x[k])
+            read_data = test_sms.loads(0, 'x')
+            assert not read_data.flags.writeable
+            assert cache.misses == 1 and cache.hits == 0
+            test_sms.loads(0, 'x')
+            assert cache.hits == 1
+            test_sms.dumps(0, 'x', x[0] * 2, over_write=True)
+            assert np.all(test_sms.loads(0, 'x') == x[0] * 2)
+            assert cache.misses == 2
+            x[0] *= 2
+
+        cache = ds.ArrayCache(3 * x[0].nbytes)
+        with closing(ds.SM_serial.open(tmp_fname, 'r', cache=cache)) as sms_a:
+            with closing(ds.SM_serial.open(tmp_fname, 'r', cache=cache)) as sms_b:
+                for k in range(M):
+                    assert np.all(sms_a.loads(k, 'x') == x[k])
+                assert cache.misses == M and cache.evictions == M - 3
+                assert cache.nbytes == 3 * x[0].nbytes
+                # the last 3 frames are shared with the other object
+                for k in range(M - 3, M):
+                    buf = np.empty(100)
+                    assert sms_b.loads(k, 'x', out=buf) is buf
+                    assert np.all(buf == x[k])
+                assert cache.hits == 3
+                assert np.all(sms_b.loads(0, 'x') == x[0])
+                assert cache.misses == M + 1
+                # out is returned on a miss as well, the cache keeps a copy
+                cache.clear()
+                buf = np.empty(100)
+                assert sms_a.loads(1, 'x', out=buf) is buf
+                assert buf.flags.writeable
+                buf[...] = 0
+                assert np.all(sms_b.loads(1, 'x') == x[1])
+
+        # in-memory files never share entries, even when one is freed and
+        # the next one reuses its id
+        images = []
+        for v in range(2):
+            with closing(ds.SM_serial.open(tmp_fname + str(v), 'w', backend='memory')) as test_sms:
+                test_sms.dumps(0, 'x', np.full(10, v))
+                images.append(test_sms.to_bytes())
+        cache = ds.ArrayCache(2 ** 20)
+        for k in range(10):
+            test_sms = ds.SM_serial.from_bytes(images[k % 2])
+            test_sms.set_cache(cache)
+            assert np.all(test_sms.loads(0, 'x') == k % 2)
+            test_sms.close()
+            del test_sms
+
+
+def test_transaction():
+    M = 5  # number of frames to dump
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_txn_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(M, 100)
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            test_sms.set_delta_encoding('x', 4, 1e-6)
+            test_sms.set_summary('x')
+            with test_sms.transaction():
+                for k in range(M):
+                    test_sms.dumps(k, 'x', x[k], meta_data={'k': k})
+                    test_sms.set_frame_md(k, {'dt': .1})
+                test_sms.update_dset_md(0, 'x', {'units': 'um'})
+                # nothing is visible before the commit
+                assert test_sms.list_frames() == []
+                try:
+                    with test_sms.transaction():
+                        pass
+                except RuntimeError:
+                    pass
+                else:
+                    assert False, "nested transaction did not raise"
+            assert '_journal' not in test_sms._file
+            assert test_sms.list_frames() == range(M)
+            assert test_sms.get_dset_md(0, 'x')['units'] == 'um'
+            assert test_sms.get_frame_md(3)['dt'] == .1
+            assert len(test_sms.get_summary('x')) == M
+
+            # a transaction which raises leaves the file as it was
+            try:
+                with test_sms.transaction():
+                    test_sms.dumps(0, 'y', x[0])
+                    test_sms.dumps(M, 'x', x[0])
+                    raise ValueError
+            except ValueError:
+                pass
+            assert '_journal' not in test_sms._file
+            assert test_sms.list_frames() == range(M)
+            assert test_sms.list_dsets(0) == ['/x']
+
+            # a keyframe can not be over written when a delta against it
+            # is staged in the same transaction
+            test_sms.dumps(M, 'x', x[0])
+            assert test_sms.get_dset_md(M, 'x')['sm_encoding'] == 'keyframe'
+            try:
+                with test_sms.transaction():
+                    test_sms.dumps(M + 1, 'x', x[0] + 1e-3)
+                    test_sms.dumps(M, 'x', x[0] * 10, over_write=True)
+            except RuntimeError:
+                pass
+            else:
+                assert False, "over writing a keyframe with staged dependents did not raise"
+            assert test_sms.list_frames() == range(M + 1)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            for k in range(M):
+                assert np.max(np.abs(test_sms.loads(k, 'x') - x[k])) <= 1e-6
+                assert test_sms.get_dset_md(k, 'x')['k'] == k
+
+
+def test_transaction_recover():
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_txn_recover_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        x = np.random.rand(3, 100)
+
+        # the process dies before the commit starts
+        test_sms = ds.SM_serial.open(tmp_fname, 'w')
+        test_sms.dumps(0, 'x', x[0])
+        txn = test_sms.transaction()
+        txn.__enter__()
+        test_sms.dumps(0, 'x', x[1], over_write=True)
+        test_sms.dumps(1, 'x', x[1])
+        test_sms._file.close()
+        test_sms._open = False
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            assert test_sms.list_frames() == [0]
+        with closing(ds.SM_serial.open(tmp_fname, 'r+')) as test_sms:
+            assert '_journal' not in test_sms._file
+            assert test_sms.list_frames() == [0]
+            assert np.all(test_sms.loads(0, 'x') == x[0])
+
+        # the process dies after the first step of the commit, before
+        # (bump_done False) and after it was recorded in the journal
+        for bump_done, data in ((True, x[::-1]), (False, x)):
+            test_sms = ds.SM_serial.open(tmp_fname, 'r+')
+
+            def crash(path):
+                # apply only the first operation
+                grp = test_sms._file[path]
+                kind, src, dst = json.loads(grp['ops'][:].tostring())[0]
+                if dst in test_sms._file:
+                    del test_sms._file[dst]
+                test_sms._file.move(src, dst)
+                if bump_done:
+                    grp.attrs['done'] = 1
+                raise KeyboardInterrupt
+            test_sms._apply_journal = crash
+            try:
+                with test_sms.transaction():
+                    for k in range(3):
+                        test_sms.dumps(k, 'x', data[k], over_write=True)
+            except KeyboardInterrupt:
+                pass
+            test_sms._file.close()
+            test_sms._open = False
+            with closing(ds.SM_serial.open(tmp_fname, 'r+')) as test_sms:
+                assert '_journal' not in test_sms._file
+                assert test_sms.list_frames() == [0, 1, 2]
+                for k in range(3):
+                    assert np.all(test_sms.loads(k, 'x') == data[k])
+            # and the file can be opened again
+            with closing(ds.SM_serial.open(tmp_fname, 'a')) as test_sms:
+                assert test_sms.list_frames() == [0, 1, 2]
+
+
+def test_peek():
+    M = 4  # number of frames to dump
+
+    with infra.path_provider() as base_path:
+        for backend, ext in (('hdf5', '.h5'), ('npy', '')):
+            # hacky version of generating a random name
+            tmp_fname = os.path.join(base_path,
+                                     ''.join(('test_peek_',
+                                             ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                             ext)))
+            with closing(ds.SM_serial.open(tmp_fname, 'w', backend=backend)) as test_sms:
+                for k in range(M):
+                    test_sms.dumps(k, 'x', np.arange(5))
+                test_sms._file.attrs['dt'] = .5
+                test_sms.build_series(['x'])
+
+            info = ds.peek(tmp_fname)
+            assert info['version'] == '0.1_chi'
+            assert info['n_frames'] == M
+            assert info['attrs']['dt'] == .5
+            assert info['attrs']['writer'] == 'sm_core/python'
+            info = ds.peek(tmp_fname, attrs=['dt', 'missing'])
+            assert info['version'] == '0.1_chi'
+            assert info['attrs'] == {'dt': .5}
+
+
+def test_lazy_import():
+    # importing the module does not import numpy or h5py
+    code = ("import sys; from sm_core import data_serialization; "
+            "assert 'numpy' not in sys.modules and 'h5py' not in sys.modules")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+    assert subprocess.call([sys.executable, '-c', code], env=env) == 0
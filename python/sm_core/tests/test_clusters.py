@@ -0,0 +1,119 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+
+
+import string
+import random
+import infra
+import numpy as np
+from contextlib import closing
+from sm_core import data_serialization as ds
+from sm_core import clusters
+import os
+
+N = 6   # parameter for random name
+
+
+def _brute_force(positions, cutoff, box):
+    delta = positions[:, None] - positions[None]
+    if box is not None:
+        box = np.asarray(box)
+        delta -= box * np.rint(delta / box)
+    bonded = np.triu((delta ** 2).sum(axis=-1) <= cutoff ** 2, 1)
+    return np.nonzero(bonded)
+
+
+def test_find_bonds():
+    # fewer than 3 cells along a dimension of the box is a special case
+    for box, cutoff in ((None, .4), ((5., 3.), .4), ((.7, 7.), .3), ((4., 4., 4.), .5)):
+        scale = (5., 3.) if box is None else box
+        positions = np.random.rand(300, len(scale)) * scale
+        i, j = clusters.find_bonds(positions, cutoff, box)
+        assert np.all(i < j)
+        bi, bj = _brute_force(positions, cutoff, box)
+        assert len(i) == len(bi)
+        assert set(zip(i, j)) == set(zip(bi, bj))
+
+
+def test_label_clusters():
+    # two chains and an isolated node, linked in a scrambled order
+    i = np.array([5, 0, 3, 2, 6])
+    j = np.array([6, 2, 1, 4, 7])
+    labels = clusters.label_clusters(8, i, j)
+    assert np.all(labels == [0, 1, 0, 1, 0, 2, 2, 2])
+    assert np.all(clusters.size_histogram(labels) == [0, 0, 1, 2])
+
+
+def test_clusters():
+    M = 4  # number of frames to dump
+    box = (6., 6.)
+    cutoff = .5
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_clusters_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        positions = [np.random.rand(200, 2) * box for _ in range(M)]
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            for k in range(M):
+                test_sms.dumps(k, 'x', positions[k][:, 0])
+                test_sms.dumps(k, 'y', positions[k][:, 1])
+            total = clusters.clusters(test_sms, cutoff, box=box, n_workers=2)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            expected_total = np.zeros(len(total), dtype=np.int64)
+            for k in range(M):
+                cluster_id = test_sms.loads(k, 'cluster_id')
+                bi, bj = _brute_force(positions[k], cutoff, box)
+                # bonded particles are in the same cluster, and the
+                # number of clusters is that of the components
+                assert np.all(cluster_id[bi] == cluster_id[bj])
+                assert cluster_id.max() + 1 == len(np.unique(
+                    clusters.label_clusters(len(cluster_id), bi, bj)))
+                hist = test_sms.loads_frame_stat(k, 'cluster_size')
+                assert np.dot(hist, np.arange(len(hist))) == len(cluster_id)
+                expected_total[:len(hist)] += hist
+                assert test_sms.get_dset_md(k, 'cluster_id')['cutoff'] == cutoff
+            assert np.all(test_sms.loads_run_stat('cluster_size') == expected_total)
+
+        # running again does not touch the results unless asked to
+        with closing(ds.SM_serial.open(tmp_fname, 'r+')) as test_sms:
+            cluster_id = test_sms.loads(1, 'cluster_id')
+            try:
+                clusters.clusters(test_sms, 4 * cutoff, box=box, frames=[1], n_workers=1)
+            except RuntimeError:
+                pass
+            else:
+                assert False, "existing results were over written"
+            assert np.all(test_sms.loads(1, 'cluster_id') == cluster_id)
+            assert test_sms.get_dset_md(1, 'cluster_id')['cutoff'] == cutoff
+            clusters.clusters(test_sms, 4 * cutoff, box=box, n_workers=1, over_write=True)
+            assert test_sms.get_dset_md(1, 'cluster_id')['cutoff'] == 4 * cutoff
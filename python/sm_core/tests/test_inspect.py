@@ -0,0 +1,97 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+
+import string
+import random
+import infra
+import json
+import subprocess
+import sys
+import numpy as np
+from contextlib import closing
+from sm_core import data_serialization as ds
+from sm_core import inspect as sm_inspect
+import os
+
+N = 6   # parameter for random name
+
+
+def _make_file(tmp_fname, M):
+    with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+        test_sms.set_summary('x')
+        test_sms.set_storage_precision('y', 'fixed', max_error=1e-3)
+        for k in range(M):
+            test_sms.dumps(k, 'x', np.random.rand(5000), meta_data={'k': k})
+            test_sms.dumps(k, 'y', np.random.rand(5000))
+            test_sms.dumps(k, 'z', np.zeros(5000), compression='gzip', chunks=(100,))
+
+
+def test_inspect():
+    M = 20  # number of frames to dump
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_inspect_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        _make_file(tmp_fname, M)
+
+        report = sm_inspect.inspect_file(tmp_fname)
+        assert report['n_frames'] == M
+        assert not report['estimated']
+        assert report['version'] == '0.1_chi'
+        x = report['columns']['particles/x']
+        assert x['frames'] == M
+        assert x['storage_bytes'] == M * 5000 * 8
+        assert x['attrs'] == M
+        assert x['chunks'] == {'contiguous': M}
+        y = report['columns']['particles/y']
+        assert y['encodings'] == {'fixed': M}
+        assert y['dtypes'] == {'<u2': M}
+        assert y['logical_bytes'] == 4 * y['raw_bytes']
+        z = report['columns']['particles/z']
+        assert z['filters'] == {'gzip=4': M}
+        assert z['chunks'] == {'(100,)': M}
+        assert z['compression_ratio'] > 10
+        assert 'summary/x' in report['other']
+        assert any(a.startswith('particles/z: chunks') for a in report['recommendations'])
+        assert report['data_storage'] <= report['file_size']
+
+        report = sm_inspect.inspect_file(tmp_fname, sample=5)
+        assert report['estimated']
+        assert report['sampled_frames'] == 5
+        assert report['columns']['particles/x']['storage_bytes'] == M * 5000 * 8
+
+        text = sm_inspect.format_report(report)
+        assert 'particles/x' in text
+
+        out = subprocess.check_output([sys.executable, '-m', 'sm_core.inspect', '--json', tmp_fname],
+                                      cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+        assert json.loads(out)['n_frames'] == M
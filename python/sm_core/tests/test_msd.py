@@ -0,0 +1,100 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+
+import string
+import random
+import infra
+import numpy as np
+from contextlib import closing
+from sm_core import data_serialization as ds
+from sm_core import msd
+import os
+
+N = 6   # parameter for random name
+
+
+def _naive_msd(pos):
+    # pos is (n_dims, n_particles, n_frames) with NaN for missing
+    T = pos.shape[-1]
+    msd_sum = np.zeros(T)
+    count = np.zeros(T, dtype=int)
+    vacf_sum = np.zeros(T - 1)
+    vacf_count = np.zeros(T - 1, dtype=int)
+    vel = np.diff(pos, axis=-1)
+    for k in range(T):
+        d = ((pos[..., k:] - pos[..., :T - k]) ** 2).sum(axis=0)
+        msd_sum[k] = np.nansum(d)
+        count[k] = np.isfinite(d).sum()
+        if k < T - 1:
+            v = (vel[..., k:] * vel[..., :T - 1 - k]).sum(axis=0)
+            vacf_sum[k] = np.nansum(v)
+            vacf_count[k] = np.isfinite(v).sum()
+    return msd_sum / count, count, vacf_sum / vacf_count, vacf_count
+
+
+def test_msd_against_naive():
+    M = 40  # number of frames
+    P = 25  # number of particles
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_msd_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        pos = 1000 + np.cumsum(np.random.randn(2, P, M), axis=-1)
+        # knock out some observations
+        pos[:, np.random.rand(P, M) < .1] = np.nan
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            for k in range(M):
+                test_sms.dumps(2 * k, 'x', pos[0, :, k])
+                test_sms.dumps(2 * k, 'y', pos[1, :, k])
+            test_sms.build_series(['x', 'y'])
+            res = msd.write_msd(test_sms, block_particles=7)
+
+        expected = _naive_msd(pos)
+        assert np.all(res['lag'] == 2 * np.arange(M))
+        assert np.allclose(res['msd'], expected[0])
+        assert np.all(res['count'] == expected[1])
+        assert np.allclose(res['vacf'], expected[2])
+        assert np.all(res['vacf_count'] == expected[3])
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            assert np.all(test_sms.loads_run_stat('msd/msd') == res['msd'])
+            md = test_sms.get_run_stat_md('msd/msd')
+            assert md['algorithm'] == 'fft'
+            assert md['n_particles'] == P
+            assert md['frame_step'] == 2
+
+            res = msd.compute_msd(test_sms, frames=range(10, 2 * M, 2), max_lag=5)
+            expected = _naive_msd(pos[..., 5:])
+            assert len(res['msd']) == 6
+            assert np.allclose(res['msd'], expected[0][:6])
+            assert np.allclose(res['vacf'], expected[2][:6])
@@ -0,0 +1,135 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+
+import string
+import random
+import infra
+import numpy as np
+from contextlib import closing
+from sm_core import data_serialization as ds
+from sm_core import pipeline
+import os
+
+N = 6   # parameter for random name
+
+
+def _make_frame(k):
+    return {'x': np.arange(1000, dtype=np.float64) * k,
+            'id': np.arange(k + 1, dtype=np.int32)}
+
+
+def _check_frames(tmp_fname, frames):
+    with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+        assert test_sms.list_frames() == sorted(frames)
+        for k in frames:
+            expected = _make_frame(k)
+            for name in expected:
+                read_data = test_sms.loads(k, name)
+                assert read_data.dtype == expected[name].dtype
+                assert np.all(read_data == expected[name])
+
+
+def test_ingest():
+    frames = range(20)[::-1]
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_ingest_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+
+        def func(k):
+            # some frames are too big for the slots and get pickled
+            return _make_frame(k), {'k': k}
+
+        seen = []
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            stats = pipeline.ingest(test_sms, func, frames, n_workers=3, n_slots=4,
+                                    slot_bytes=8 * 1000 + 100,
+                                    progress=lambda s: seen.append(s['frames']))
+        # one call per commit, a commit may hold several frames
+        assert seen == sorted(set(seen)) and seen[-1] == len(frames)
+        assert stats['frames'] == len(frames)
+        assert stats['restarts'] == 0
+        assert 0 < stats['pickled'] < len(frames)
+        assert stats['max_reorder'] < 4
+        _check_frames(tmp_fname, frames)
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            assert test_sms.get_frame_md(7)['k'] == 7
+
+
+def test_ingest_worker_crash():
+    frames = range(12)
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_ingest_crash_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        marker = os.path.join(base_path, 'crashed')
+
+        def func(k):
+            if k == 5 and not os.path.exists(marker):
+                open(marker, 'w').close()
+                os._exit(1)
+            return _make_frame(k)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            stats = pipeline.ingest(test_sms, func, frames, n_workers=2)
+        assert stats['restarts'] == 1
+        _check_frames(tmp_fname, frames)
+
+
+def test_ingest_error():
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_ingest_error_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+
+        def func(k):
+            if k == 3:
+                raise ValueError("bad frame")
+            return _make_frame(k)
+
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            try:
+                pipeline.ingest(test_sms, func, range(8), n_workers=2, n_slots=2)
+            except RuntimeError as e:
+                assert 'bad frame' in str(e)
+            else:
+                assert False
+        # whatever was written is a prefix of whole frames
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            written = test_sms.list_frames()
+        assert written == range(len(written))
+        assert len(written) <= 3
+        _check_frames(tmp_fname, written)
@@ -0,0 +1,123 @@
+#Copyright 2013 Thomas A Caswell
+#tcaswell@uchicago.edu
+#http://jfi.uchicago.edu/~tcaswell
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#The views and conclusions contained in the software and documentation are those
+#of the authors and should not be interpreted as representing official policies,
+#either expressed or implied, of the FreeBSD Project.
+#
+
+import string
+import random
+import infra
+import numpy as np
+from contextlib import closing
+from sm_core import data_serialization as ds
+from sm_core import sofk
+import os
+
+N = 6   # parameter for random name
+
+
+def test_sofk_against_direct_sum():
+    # particles on grid points are binned exactly, so without the window
+    # correction the FFT result is the direct sum over wave vectors
+    box = np.array([10., 8.])
+    n_grid = (20, 16)
+    positions = np.random.randint(0, 16, size=(300, 2)) * (box / n_grid)
+    k_bins = sofk.make_k_bins(box, n_grid)
+    k, s, count = sofk.compute_sofk(positions, box, k_bins, n_grid=n_grid, deconvolve=False)
+
+    m = np.meshgrid(*[np.fft.fftfreq(n, d=1. / n) for n in n_grid], indexing='ij')
+    kv = np.array([2 * np.pi * mi.ravel() / L for mi, L in zip(m, box)]).T
+    k_mag = np.sqrt((kv ** 2).sum(axis=1))
+    rho_k = np.exp(-1j * kv.dot(positions.T)).sum(axis=1)
+    s_direct = np.abs(rho_k) ** 2 / len(positions)
+    for j in range(len(k_bins) - 1):
+        use = (k_mag >= k_bins[j]) & (k_mag < k_bins[j + 1]) & (k_mag > 0)
+        assert count[j] == use.sum()
+        if use.sum():
+            assert np.allclose(s[j], s_direct[use].mean())
+            assert np.allclose(k[j], k_mag[use].mean())
+
+
+def test_sofk_ideal_gas():
+    M = 4   # number of frames
+    box = np.array([20., 20.])
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_sofk_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            for j in range(M):
+                test_sms.dumps(j, 'x', np.random.rand(20000) * box[0])
+                test_sms.dumps(j, 'y', np.random.rand(20000) * box[1])
+            k, s_mean = sofk.sofk(test_sms, box, n_grid=64)
+
+        # uncorrelated particles have S(k) = 1
+        assert np.all(np.isfinite(s_mean))
+        assert abs(s_mean.mean() - 1) < .1
+
+        with closing(ds.SM_serial.open(tmp_fname, 'r')) as test_sms:
+            assert np.all(test_sms.loads_run_stat('sofk/k') == k)
+            assert np.all(test_sms.loads_run_stat('sofk/sofk') == s_mean)
+            per_frame = np.array([test_sms.loads_frame_stat(j, 'sofk') for j in range(M)])
+            assert np.allclose(per_frame.mean(axis=0), s_mean)
+            assert test_sms.get_run_stat_md('sofk/sofk')['n_frames'] == M
+
+
+def test_sofk_no_half_write():
+    box = np.array([10., 10.])
+
+    with infra.path_provider() as base_path:
+        # hacky version of generating a random name
+        tmp_fname = os.path.join(base_path,
+                                 ''.join(('test_sofk_rerun_',
+                                         ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(N)),
+                                         '.h5')))
+        with closing(ds.SM_serial.open(tmp_fname, 'w')) as test_sms:
+            for j in range(4):
+                test_sms.dumps(j, 'x', np.random.rand(500) * box[0])
+                test_sms.dumps(j, 'y', np.random.rand(500) * box[1])
+            sofk.sofk(test_sms, box, frames=[0, 1], n_grid=16)
+            # the run level statistics exist, so nothing may be written
+            try:
+                sofk.sofk(test_sms, box, frames=[2, 3], n_grid=16)
+            except RuntimeError:
+                pass
+            else:
+                assert False
+            for j in (2, 3):
+                try:
+                    test_sms.loads_frame_stat(j, 'sofk')
+                except KeyError:
+                    pass
+                else:
+                    assert False
+            # over_write replaces everything
+            k, s_mean = sofk.sofk(test_sms, box, frames=[2, 3], n_grid=16, over_write=True)
+            assert np.all(test_sms.loads_run_stat('sofk/sofk') == s_mean)